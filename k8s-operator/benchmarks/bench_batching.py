@@ -0,0 +1,38 @@
+import argparse
+import os
+import sys
+import time
+
+from fake_backend import FakeBackend
+
+parser = argparse.ArgumentParser(description="Compare batched and single app installs against the fake backend")
+parser.add_argument("--apps", type=int, default=30)
+parser.add_argument("--latency", type=float, default=0.02)
+args = parser.parse_args()
+
+fake = FakeBackend(latency=args.latency).start()
+os.environ["ORCH_BACKEND_URL"] = fake.url
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "kopf-operator"))
+
+from providers.apps import apps
+from providers.backend import backend
+
+appDataList = [
+    {"name": f"app-{i}", "owner": "bench", "cluster": "green", "components": [], "id": str(i), "crd_name": "bench"}
+    for i in range(args.apps)
+]
+
+for label, batching in (("batched", True), ("pipelined", False), ("sequential", None)):
+    fake.reset()
+    fake.batching = bool(batching)
+    backend._unsupported_batches.clear()
+
+    start = time.perf_counter()
+    if batching is None:
+        for appData in appDataList:
+            apps.install_app(appData)
+    else:
+        apps.install_apps(appDataList)
+    elapsed = time.perf_counter() - start
+
+    print(f"{label:>10}: {sum(fake.requests.values()):4d} requests, {elapsed * 1000:8.1f} ms for {args.apps} apps")
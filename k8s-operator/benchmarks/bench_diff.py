@@ -0,0 +1,59 @@
+import argparse
+import copy
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "kopf-operator"))
+
+import diffing
+import model
+
+
+def make_body(apps, clusters):
+    return {
+        "spec": {
+            "clusters": [
+                {"name": f"cluster-{i}", "kubernetes-type": "kubeadm", "worker-machine-count": 1, "status": "ready"}
+                for i in range(clusters)
+            ],
+            "apps": [
+                {"id": str(i), "name": f"app-{i}", "cluster": f"cluster-{i % max(clusters, 1)}",
+                 "components": [{"name": "web", "image": "docker.io/kong/httpbin"}], "status": "ready"}
+                for i in range(apps)
+            ],
+        }
+    }
+
+def mutate(body):
+    # Touch a tenth of the entries: new apps, removed apps, status-only and real changes
+    new = copy.deepcopy(body)
+    apps = new["spec"]["apps"]
+    for i in range(0, len(apps), 10):
+        apps[i]["status"] = "deploying"
+    for i in range(1, len(apps), 10):
+        apps[i]["components"][0]["image"] = "docker.io/kong/httpbin:latest"
+    del apps[2::10]
+    apps.extend({"id": f"new-{i}", "name": f"new-{i}", "cluster": "cluster-0", "components": [], "status": ""}
+                for i in range(len(apps) // 10))
+    return new
+
+
+parser = argparse.ArgumentParser(description="Measure how diff_spec scales with the number of apps")
+parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 50000])
+args = parser.parse_args()
+
+for size in args.sizes:
+    old = make_body(size, max(size // 10, 1))
+    new = mutate(old)
+    runs = max(1, 100000 // size)
+
+    def diff():
+        # Parsing is part of it, each event brings a new body
+        old_spec, new_spec = model.parse(old), model.parse(new)
+        return diffing.diff_spec(old_spec, new_spec, "apps"), diffing.diff_spec(old_spec, new_spec, "clusters")
+
+    seconds = timeit.timeit(diff, number=runs) / runs
+    result = diff()[0]
+    print(f"{size:6d} apps: {seconds * 1000:8.3f} ms per diff, {seconds / size * 1e6:6.3f} us per app "
+          f"({len(result.create)} create, {len(result.update)} update, {len(result.delete)} delete)")
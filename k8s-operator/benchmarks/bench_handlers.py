@@ -0,0 +1,237 @@
+import argparse
+import asyncio
+import copy
+import importlib.util
+import logging
+import os
+import resource
+import socket
+import sys
+import time
+import tracemalloc
+
+import kopf
+import yaml
+
+from fake_backend import FakeBackend
+
+OPERATOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "kopf-operator")
+
+parser = argparse.ArgumentParser(description="Drive the operator's handlers with synthetic LowLevelOrchestrations")
+parser.add_argument("--example", default=os.path.join(OPERATOR_DIR, "examples", "liqo-kubeadm-with-apps.yaml"),
+                    help="LowLevelOrchestration the synthetic ones are made from")
+parser.add_argument("--objects", type=int, default=20, help="LowLevelOrchestrations handled at once")
+parser.add_argument("--clusters", type=int, default=5, help="clusters per LowLevelOrchestration")
+parser.add_argument("--apps", type=int, default=20, help="apps per LowLevelOrchestration")
+parser.add_argument("--latency", type=float, default=0.02, help="seconds the fake backend takes per call")
+parser.add_argument("--error-rate", type=float, default=0.0, help="share of backend calls answered 503")
+parser.add_argument("--seed", type=int, default=1)
+parser.add_argument("--callbacks", action="store_true",
+                    help="have the fake backend report completed operations instead of the statuses being fed in")
+parser.add_argument("--callback-delay", type=float, default=0.05, help="seconds before the fake backend calls back")
+parser.add_argument("--log-level", default="WARNING",
+                    help="level the operator logs at, INFO to include the cost of its per-entry messages")
+args = parser.parse_args()
+
+fake = FakeBackend(latency=args.latency, error_rate=args.error_rate, seed=args.seed,
+                   callback_secret="bench" if args.callbacks else None, callback_delay=args.callback_delay).start()
+os.environ["ORCH_BACKEND_URL"] = fake.url
+if args.callbacks:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    os.environ["CALLBACK_PORT"] = str(port)
+    os.environ["OPERATOR_CALLBACK_URL"] = f"http://127.0.0.1:{port}/callbacks"
+    os.environ["CALLBACK_SECRET"] = "bench"
+# Updates are handled straight away instead of waiting for more changes
+os.environ.setdefault("DEBOUNCE_WINDOW", "0")
+os.environ.setdefault("BACKEND_BACKOFF_BASE", "0.05")
+os.environ.setdefault("STATUS_FLUSH_INTERVAL", "0.2")
+os.environ.setdefault("TEARDOWN_POLL_INTERVAL", "0.05")
+sys.path.insert(0, OPERATOR_DIR)
+
+spec = importlib.util.spec_from_file_location("operator", os.path.join(OPERATOR_DIR, "k8s-operator.py"))
+operator = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(operator)
+
+import callbacks
+import logs
+import planner
+import writeback
+
+# Cluster the synthetic ones are made from when the example has none, e.g. eu-cnc-dotes.yaml
+DEFAULT_CLUSTER = {
+    "provider": "kubeadm",
+    "kubernetes-version": "v1.25.0",
+    "control-plane-count": 1,
+    "control-plane-flavor": "m1.medium",
+    "worker-machine-count": 0,
+    "worker-machine-flavor": "m1.medium",
+    "image": "ubuntu-2004-kube-v1.25",
+}
+
+class StatusApi:
+    """Stands in for the Kubernetes API the status progress is patched to."""
+
+    def __init__(self):
+        self.patches = 0
+
+    def patch_namespaced_custom_object(self, group, version, namespace, plural, name, body):
+        self.patches += 1
+
+
+def synthetic(template, index):
+    # Copy of the example with its first cluster and app repeated
+    name = f"{template['metadata']['name']}-{index}"
+    spec = template.get("spec") or {}
+    cluster = (spec.get("clusters") or [DEFAULT_CLUSTER])[0]
+    app = (spec.get("apps") or [{}])[0]
+
+    # The examples predate some of the fields the operator reads now
+    cluster = dict(cluster)
+    cluster.setdefault("kubernetes-type", cluster.get("provider", "kubeadm"))
+    cluster.setdefault("datacenter", "bench")
+
+    clusters = []
+    for i in range(args.clusters):
+        clusters.append(dict(copy.deepcopy(cluster), name=f"{name}-c{i}", status=""))
+
+    apps = []
+    for i in range(args.apps):
+        target = f"{name}-{clusters[i % len(clusters)]['name']}"
+        apps.append(dict(copy.deepcopy(app), name=f"app-{i}", id=f"{name}-{i}", cluster=target, status=""))
+
+    links = [[clusters[i]["name"], clusters[i + 1]["name"]] for i in range(len(clusters) - 1)]
+
+    return {
+        "apiVersion": template.get("apiVersion"),
+        "kind": template.get("kind"),
+        "metadata": {"name": name, "namespace": "bench", "uid": f"uid-{name}",
+                     "creationTimestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())},
+        "spec": {"clusters": clusters, "links": links, "apps": apps},
+    }
+
+def changed(body):
+    # Scale every other cluster, drop a quarter of the apps and add as many
+    new = copy.deepcopy(body)
+    spec = new["spec"]
+    for cluster in spec["clusters"][::2]:
+        cluster["worker-machine-count"] = int(cluster.get("worker-machine-count") or 0) + 2
+    removed = len(spec["apps"]) // 4
+    added = copy.deepcopy(spec["apps"][-removed:]) if removed else []
+    del spec["apps"][:removed]
+    for i, app in enumerate(added):
+        app["id"], app["name"] = f"{app['id']}-new", f"{app['name']}-new-{i}"
+    spec["apps"].extend(added)
+    return new
+
+def with_statuses(body, status):
+    # What the backend writes back once the clusters are up
+    observed = copy.deepcopy(body)
+    for cluster in observed["spec"]["clusters"]:
+        cluster["status"] = status
+    return observed
+
+async def timed(latencies, handler, **kwargs):
+    kwargs.setdefault("patch", kopf.Patch())
+    kwargs.setdefault("logger", logging.getLogger())
+    start = time.perf_counter()
+    await handler(**kwargs)
+    latencies.append(time.perf_counter() - start)
+    return kwargs["patch"]
+
+async def deployed(bodies):
+    # Report the clusters ready as soon as the fake backend has all of an object's
+    # clusters, or stop waiting once the rollout has given up
+    waiting = list(bodies)
+    while waiting:
+        await asyncio.sleep(0.02)
+        for body in list(waiting):
+            if (body["metadata"]["namespace"], body["metadata"]["name"]) not in planner._running:
+                waiting.remove(body)
+            elif all(cluster["name"] in fake.clusters for cluster in body["spec"]["clusters"]):
+                await operator.llorchestration_seen(event={"type": "MODIFIED"}, body=with_statuses(body, "ready"))
+                waiting.remove(body)
+
+async def rollouts():
+    while planner._running:
+        await asyncio.sleep(0.01)
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(int(len(values) * share), len(values) - 1)]
+
+def report(phase, latencies, elapsed):
+    requests = sum(fake.requests.values())
+    errors = sum(fake.errors.values())
+    print(f"{phase:>7}: {len(latencies) / elapsed:8.1f} objects/s, handler p50 {percentile(latencies, 0.5) * 1000:8.2f} ms,"
+          f" p99 {percentile(latencies, 0.99) * 1000:8.2f} ms, {elapsed:7.2f} s to converge,"
+          f" {requests:5d} backend calls ({errors} failed)"
+          + (f", {sum(fake.callbacks.values())} callbacks" if args.callbacks else ""))
+
+async def main():
+    with open(args.example) as f:
+        template = yaml.safe_load(f)
+
+    writeback._api = StatusApi()
+    logs.setup()
+    await callbacks.start()
+    bodies = [synthetic(template, index) for index in range(args.objects)]
+    print(f"{args.objects} LowLevelOrchestrations of {args.clusters} clusters and {args.apps} apps, "
+          f"backend latency {args.latency * 1000:.0f} ms, error rate {args.error_rate:.0%}"
+          + (f", callbacks after {args.callback_delay * 1000:.0f} ms" if args.callbacks else ""))
+
+    tracemalloc.start()
+
+    # Create: handlers return once the rollouts are started, which then wait for the clusters
+    fake.reset(state=True)
+    latencies = []
+    start = time.perf_counter()
+    patches = await asyncio.gather(*(timed(latencies, operator.llorchestration_create, body=body) for body in bodies))
+    if args.callbacks:
+        await rollouts()
+    else:
+        await asyncio.gather(deployed(bodies), rollouts())
+    report("create", latencies, time.perf_counter() - start)
+
+    # The status the operator wrote back, so the update sees the stored fingerprints
+    ready = []
+    for body, patch in zip(bodies, patches):
+        body = with_statuses(body, "ready")
+        body["status"] = copy.deepcopy(dict(patch.get("status") or {}))
+        ready.append(body)
+
+    # Update: scale half of the clusters and replace a quarter of the apps
+    fake.reset()
+    latencies = []
+    updated = [changed(body) for body in ready]
+    for old, new in zip(ready, updated):
+        new["status"] = old["status"]
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        timed(latencies, operator.llorchestration_update, body=new, spec=new["spec"], old=old, new=new, diff=None,
+              started=None)
+        for old, new in zip(ready, updated)
+    ))
+    await rollouts()
+    report("update", latencies, time.perf_counter() - start)
+
+    # Delete: tear down the apps, then the links, then the clusters
+    fake.reset()
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(latencies, operator.llorchestration_delete, body=body, old=body, new=None)
+                           for body in updated))
+    report("delete", latencies, time.perf_counter() - start)
+
+    await writeback.flush()
+    await callbacks.stop()
+    logs.stop()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f" memory: {peak / 2**20:8.1f} MiB traced peak, {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:8.1f} MiB max RSS,"
+          f" {writeback._api.patches} status patches")
+
+
+logging.basicConfig(level=args.log_level)
+asyncio.run(main())
@@ -0,0 +1,83 @@
+import argparse
+import copy
+import os
+import sys
+import time
+import tracemalloc
+
+import yaml
+
+OPERATOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "kopf-operator")
+sys.path.insert(0, OPERATOR_DIR)
+
+import diffing
+import fingerprints
+import metrics
+import model
+import operations
+import payloads
+import readiness
+
+
+def make_body(template, copies, version):
+    # The example's apps repeated, each copy with its own ids
+    apps = []
+    for i in range(copies):
+        for index, app in enumerate(template["spec"].get("apps") or []):
+            apps.append(dict(copy.deepcopy(app), id=f"{i}-{index}", status=""))
+    return {
+        "metadata": {"name": "bench", "namespace": "bench", "uid": "uid-bench", "resourceVersion": str(version)},
+        "spec": {"clusters": copy.deepcopy(template["spec"].get("clusters") or []),
+                 "links": copy.deepcopy(template["spec"].get("links") or []), "apps": apps},
+    }
+
+def status_event(body, version):
+    # The backend writing back the status of every other app
+    new = copy.deepcopy(body)
+    new["metadata"]["resourceVersion"] = str(version)
+    for app in new["spec"]["apps"][::2]:
+        app["status"] = "ready"
+    return new
+
+def handle(old, new):
+    # What the watch event and the update handler do with one new version
+    readiness.observe(new)
+    spec = model.parse(new)
+    fingerprints.spec_fingerprints(spec)
+    metrics.count(spec)
+    old_spec = model.parse(old, strict=False)
+    for field in ("clusters", "links", "apps"):
+        diffing.diff_spec(old_spec, spec, field)
+    for app in spec.apps.values():
+        operations.idempotency_key(new, "install", app.id, app.fingerprint)
+        payloads.app_payload(app, new["metadata"]["name"])
+
+
+parser = argparse.ArgumentParser(description="Measure the per-event cost of parsing and serialising a spec")
+parser.add_argument("--example", default=os.path.join(OPERATOR_DIR, "examples", "eu-cnc-dotes.yaml"),
+                    help="LowLevelOrchestration whose apps are repeated")
+parser.add_argument("--copies", type=int, nargs="+", default=[1, 10, 100])
+parser.add_argument("--events", type=int, default=50)
+args = parser.parse_args()
+
+with open(args.example) as f:
+    template = yaml.safe_load(f)
+
+for copies in args.copies:
+    bodies = [make_body(template, copies, 0)]
+    for version in range(1, args.events + 1):
+        bodies.append(status_event(bodies[0], version))
+
+    start = time.perf_counter()
+    for old, new in zip(bodies, bodies[1:]):
+        handle(old, new)
+    seconds = (time.perf_counter() - start) / args.events
+
+    new = status_event(bodies[0], args.events + 1)
+    tracemalloc.start()
+    handle(bodies[0], new)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    apps = len(bodies[0]["spec"]["apps"])
+    print(f"{apps:6d} apps: {seconds * 1000:8.3f} ms per event, {peak / 1024:8.1f} KiB allocated at peak")
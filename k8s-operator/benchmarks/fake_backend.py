@@ -0,0 +1,171 @@
+import argparse
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+import urllib.request
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Endpoints of the orch-backend that accept a JSON list of items
+BATCH_PATHS = {"/v1/installapps", "/v1/uninstallapps"}
+# Endpoints whose work is reported done through a completion callback
+CALLBACK_PATHS = {"/v1/deploycluster", "/v1/peer", "/v1/installapp", "/v1/installapps"}
+
+
+class FakeBackend(ThreadingHTTPServer):
+    """Local stand-in for orch-backend that keeps what it was asked to deploy and counts every call."""
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, port=0, latency=0.0, batching=True, error_rate=0.0, seed=None, callback_secret=None,
+                 callback_delay=0.0):
+        super().__init__(("127.0.0.1", port), FakeBackendHandler)
+        self.latency = latency
+        self.batching = batching
+        # Share of the calls answered 503 without being applied
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        # Completion callbacks are sent callback_delay seconds after the answer,
+        # signed with callback_secret, to requests that carry a Callback-Url
+        self.callback_secret = callback_secret
+        self.callback_delay = callback_delay
+        self.callbacks = Counter()
+        self.errors = Counter()
+        self.requests = Counter()
+        self.items = Counter()
+        self.clusters = {}
+        self.apps = {}
+        self.links = set()
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/v1"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def reset(self, state=False):
+        with self.lock:
+            self.requests.clear()
+            self.items.clear()
+            self.errors.clear()
+            self.callbacks.clear()
+            if state:
+                self.clusters.clear()
+                self.apps.clear()
+                self.links.clear()
+
+    def apply(self, method, path, query, payload):
+        # Keep the deployed clusters and apps so GET /clusters and /apps reflect them
+        items = payload if path in BATCH_PATHS else [payload]
+
+        if path == "/v1/deploycluster":
+            for cluster in items:
+                self.clusters[cluster["clusterName"]] = cluster
+        elif path in ("/v1/installapp", "/v1/installapps"):
+            for app in items:
+                self.apps[app["id"]] = app
+        elif path == "/v1/uninstallapp":
+            self.apps.pop(query.get("id", [None])[0], None)
+        elif path == "/v1/uninstallapps":
+            for app in items:
+                self.apps.pop(app["id"], None)
+        elif path.startswith("/v1/deletecluster/"):
+            self.clusters.pop(path.split("/")[3], None)
+        elif path.startswith("/v1/cluster/") and method == "PATCH":
+            self.clusters.setdefault(path.split("/")[3], {}).update(payload)
+        elif path == "/v1/peer":
+            self.links.add((query["greenClusterName"][0], query["roseClusterName"][0]))
+        elif path == "/v1/unpeer":
+            self.links.discard((query["greenClusterName"][0], query["roseClusterName"][0]))
+        elif path == "/v1/clusters":
+            return list(self.clusters.values())
+        elif path == "/v1/apps":
+            return list(self.apps.values())
+
+    def call_back(self, url, keys):
+        # Report the operations of one request done, as the real backend does
+        # once the clusters are up, the link is made or the app runs
+        payload = json.dumps([{"idempotencyKey": key, "status": "succeeded"} for key in keys]).encode()
+        signature = "sha256=" + hmac.new(self.callback_secret.encode(), payload, hashlib.sha256).hexdigest()
+        request = urllib.request.Request(url, data=payload, method="POST", headers={
+            "Content-Type": "application/json", "X-Signature-256": signature,
+        })
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                status = response.status
+        except Exception as e:
+            status = getattr(e, "code", "error")
+        with self.lock:
+            self.callbacks[status] += 1
+
+
+class FakeBackendHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def handle_call(self):
+        url = urlsplit(self.path)
+        path = url.path
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length)) if length else None
+
+        if path in BATCH_PATHS and not self.server.batching:
+            return self.answer(404)
+
+        with self.server.lock:
+            self.server.requests[path] += 1
+            failed = self.server.random.random() < self.server.error_rate
+            if failed:
+                self.server.errors[path] += 1
+            else:
+                self.server.items[path] += len(payload) if path in BATCH_PATHS else 1
+                result = self.server.apply(self.command, path, parse_qs(url.query), payload)
+
+        time.sleep(self.server.latency)
+        if failed:
+            self.answer(503)
+            return
+        self.answer(200, result)
+
+        callback_url = self.headers.get("Callback-Url")
+        keys = [key for key in self.headers.get("Idempotency-Key", "").split(",") if key]
+        if callback_url and keys and self.server.callback_secret and path in CALLBACK_PATHS:
+            timer = threading.Timer(self.server.callback_delay, self.server.call_back, (callback_url, keys))
+            timer.daemon = True
+            timer.start()
+
+    def answer(self, code, result=None):
+        body = json.dumps(result).encode() if result is not None else b""
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PATCH = do_DELETE = handle_call
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake orch-backend")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every answer")
+    parser.add_argument("--no-batch", action="store_true", help="answer 404 on the batch endpoints")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of the calls answered 503")
+    parser.add_argument("--callback-secret", help="send completion callbacks signed with this secret")
+    parser.add_argument("--callback-delay", type=float, default=0.0, help="seconds before the completion callback")
+    args = parser.parse_args()
+
+    backend = FakeBackend(args.port, args.latency, not args.no_batch, args.error_rate,
+                          callback_secret=args.callback_secret, callback_delay=args.callback_delay)
+    print(f"Fake orch-backend listening on {backend.url}")
+    backend.serve_forever()
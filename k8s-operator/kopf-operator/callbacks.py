@@ -0,0 +1,202 @@
+# Completion callbacks from the orch-backend. Deploying a cluster, linking
+# two clusters and installing an app are only accepted by the backend when
+# the request returns; when the work is done, the backend POSTs to the URL
+# sent along in the Callback-Url header:
+#
+#   POST /callbacks
+#   X-Signature-256: sha256=<HMAC-SHA256 of the body with CALLBACK_SECRET>
+#   {"idempotencyKey": "<Idempotency-Key of the request>", "status": "succeeded" | "failed", "error": "..."}
+#
+# or a JSON list of those, one per item of a batch request. The key maps the
+# callback back to the object and entry it was for, and whatever waits for
+# that entry is woken up at once instead of at its next poll.
+#
+# Callbacks are off unless both OPERATOR_CALLBACK_URL and CALLBACK_SECRET are
+# set. With sharding, the URL has to reach this replica, e.g. the pod IP.
+
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+
+from aiohttp import web
+
+import metrics
+import model
+import readiness
+from providers.backend import backend
+
+CALLBACK_PORT = int(os.environ.get("CALLBACK_PORT", "6000"))
+CALLBACK_URL = os.environ.get("OPERATOR_CALLBACK_URL", "")
+CALLBACK_SECRET = os.environ.get("CALLBACK_SECRET", "")
+# Longest wait for the callback of a link or an app before going on without it
+CALLBACK_TIMEOUT = float(os.environ.get("CALLBACK_TIMEOUT", "300"))
+
+SIGNATURE_HEADER = "X-Signature-256"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# idempotency key -> (body, kind, entry key) of the operations whose callback is expected
+_expected = {}
+# (namespace, name, kind, entry key) -> idempotency key of its latest operation
+_latest = {}
+# (namespace, name, kind, entry key) -> futures waiting for the completion
+_waiters = {}
+# (namespace, name, kind, entry key) -> (idempotency key, status, error) of
+# the last callback, for operations that are waited for after it came or
+# that the work queue did not send again
+_completed = {}
+
+_runner = None
+
+
+class OperationFailed(Exception):
+    pass
+
+
+def enabled():
+    return _runner is not None
+
+def entry_key(body, kind, key):
+    return (*model.object_key(body), kind, key)
+
+def expect(body, kind, key, idempotency):
+    # Called when an operation is submitted; a newer operation on the same
+    # entry replaces the older one
+    if not enabled():
+        return
+    entry = entry_key(body, kind, key)
+    if _completed.get(entry, (None,))[0] == idempotency:
+        return
+    _completed.pop(entry, None)
+    previous = _latest.get(entry)
+    if previous is not None and previous != idempotency:
+        _expected.pop(previous, None)
+    _latest[entry] = idempotency
+    _expected[idempotency] = (body, kind, key)
+
+def complete(idempotency, status, error=None):
+    # Returns False for a key no operation is waiting on
+    expected = _expected.pop(idempotency, None)
+    if expected is None:
+        return False
+
+    body, kind, key = expected
+    entry = entry_key(body, kind, key)
+    _latest.pop(entry, None)
+    metrics.backend_callbacks.labels(kind, status).inc()
+
+    if kind == "clusters":
+        # Deployed clusters are waited for through their readiness
+        readiness.set_status(readiness.cluster_key(body, key), "ready" if status == SUCCEEDED else "error")
+        return True
+
+    _completed[entry] = (idempotency, status, error)
+    for future in _waiters.pop(entry, []):
+        if future.done():
+            continue
+        if status == SUCCEEDED:
+            future.set_result(status)
+        else:
+            future.set_exception(OperationFailed(error or f"{kind} {key} failed"))
+    return True
+
+async def completion(body, kind, key):
+    # Wait for the callback of the last operation on a link or an app.
+    # Returns False, so the caller goes on as before, when callbacks are off
+    # or none came within CALLBACK_TIMEOUT; raises OperationFailed if the
+    # backend reported a failure.
+    if not enabled():
+        return False
+
+    entry = entry_key(body, kind, key)
+    if entry not in _latest:
+        # Nothing outstanding: it is done already, or was not expected
+        if entry not in _completed:
+            return False
+        _, status, error = _completed[entry]
+        if status != SUCCEEDED:
+            raise OperationFailed(error or f"{kind} {key} failed")
+        return True
+
+    future = asyncio.get_running_loop().create_future()
+    _waiters.setdefault(entry, []).append(future)
+    try:
+        await asyncio.wait_for(future, CALLBACK_TIMEOUT)
+    except asyncio.TimeoutError:
+        logging.warning("No completion callback for %s %s in %.0fs, going on without it", kind, key, CALLBACK_TIMEOUT)
+        _expected.pop(_latest.pop(entry, None), None)
+        return False
+    finally:
+        waiters = _waiters.get(entry, [])
+        if future in waiters:
+            waiters.remove(future)
+        if not waiters:
+            _waiters.pop(entry, None)
+    return True
+
+def forget(body):
+    key = model.object_key(body)
+    for entry in [entry for entry in _latest if entry[:2] == key]:
+        _expected.pop(_latest.pop(entry), None)
+    for entry in [entry for entry in _completed if entry[:2] == key]:
+        del _completed[entry]
+    for entry in [entry for entry in _waiters if entry[:2] == key]:
+        for future in _waiters.pop(entry):
+            future.cancel()
+
+def signature(payload):
+    return "sha256=" + hmac.new(CALLBACK_SECRET.encode(), payload, hashlib.sha256).hexdigest()
+
+def signed(payload, header):
+    # Compared as bytes: compare_digest raises on non-ASCII str
+    return hmac.compare_digest(header.encode("utf-8", "surrogateescape"), signature(payload).encode())
+
+async def handle(request):
+    payload = await request.read()
+    if not signed(payload, request.headers.get(SIGNATURE_HEADER, "")):
+        metrics.backend_callbacks.labels("", "unauthorized").inc()
+        return web.json_response({"error": "bad signature"}, status=401)
+
+    try:
+        items = json.loads(payload)
+        items = items if isinstance(items, list) else [items]
+        results = [(item["idempotencyKey"], item["status"], item.get("error")) for item in items]
+    except (ValueError, TypeError, KeyError) as e:
+        return web.json_response({"error": f"bad callback: {e}"}, status=400)
+
+    accepted = 0
+    for idempotency, status, error in results:
+        if status not in (SUCCEEDED, FAILED):
+            logging.warning("Callback for %s has an unknown status %r", idempotency, status)
+        elif complete(idempotency, status, error):
+            accepted += 1
+    return web.json_response({"accepted": accepted, "unknown": len(results) - accepted}, status=202)
+
+async def start():
+    global _runner
+
+    if not CALLBACK_URL or not CALLBACK_SECRET:
+        if CALLBACK_URL:
+            logging.warning("OPERATOR_CALLBACK_URL is set without CALLBACK_SECRET, completion callbacks are off")
+        return
+
+    app = web.Application()
+    app.router.add_post("/callbacks", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", CALLBACK_PORT).start()
+    _runner = runner
+    backend.callback_url = CALLBACK_URL
+    logging.info("Listening for completion callbacks on port %d", CALLBACK_PORT)
+
+async def stop():
+    global _runner
+
+    if _runner is None:
+        return
+    backend.callback_url = None
+    await _runner.cleanup()
+    _runner = None
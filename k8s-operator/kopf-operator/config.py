@@ -1,15 +1,8 @@
-from providers.kubeadm import kubeadm
-from providers.liqo import liqo
-from providers.apps import apps
+import os
 
-PROVIDERS = {
-   "kubeadm": kubeadm
-}
+# Providers of the links and apps, which the spec does not name (see providers/registry.py)
+LINK_PROVIDER = os.environ.get("LINK_PROVIDER", "liqo")
+APP_PROVIDER = os.environ.get("APP_PROVIDER", "apps")
 
-LINKS = {
-    "liqo": liqo
-}
-
-APPS = {
-    "apps": apps
-}
\ No newline at end of file
+# Maximum number of orch-backend requests a handler keeps in flight at once
+BACKEND_CONCURRENCY = int(os.environ.get("BACKEND_CONCURRENCY", "10"))
@@ -0,0 +1,78 @@
+import logging
+import os
+import time
+
+import kopf
+
+import model
+
+# Seconds a LowLevelOrchestration must stay unchanged before its update is handled
+DEBOUNCE_WINDOW = float(os.environ.get("DEBOUNCE_WINDOW", "3"))
+
+# (namespace, name) -> (spec fingerprints waiting to be handled, time.monotonic() they were first seen)
+_pending = {}
+# (namespace, name) -> time.monotonic() the last update was handled
+_handled = {}
+
+
+class Waiting(kopf.TemporaryError):
+    """Raised by the update handler to be called again once the spec has settled."""
+
+    PREFIX = "Waiting for more changes"
+
+    def __init__(self, name, delay):
+        super().__init__(f"{self.PREFIX} to {name}, {delay:.1f}s left", delay=delay)
+
+
+class Quiet(logging.Filter):
+    """Logs kopf's retries of a waiting update at debug level, and posts no Event for them."""
+
+    def filter(self, record):
+        # kopf logs every TemporaryError as "<handler> failed temporarily: <error>"
+        if record.levelno != logging.ERROR or f"failed temporarily: {Waiting.PREFIX}" not in str(record.msg):
+            return True
+        record.levelno, record.levelname = logging.DEBUG, logging.getLevelName(logging.DEBUG)
+        return logging.getLogger(record.name).isEnabledFor(logging.DEBUG)
+
+
+def setup():
+    # Called once at startup; kopf logs the handlers' errors on this logger
+    logging.getLogger("kopf.objects").addFilter(Quiet())
+
+def remaining(body, fingerprints):
+    # Seconds left before the update can be handled. The first change to an
+    # object that was quiet for DEBOUNCE_WINDOW is handled at once; changes
+    # following it within the window wait until the spec has been stable for
+    # the window, and any change while waiting starts it again. kopf keeps
+    # the last handled spec as the diff base until the handler succeeds, so
+    # the update that finally runs sees the net change of every patch made
+    # in between.
+    if DEBOUNCE_WINDOW <= 0:
+        return 0
+
+    key = model.object_key(body)
+    now = time.monotonic()
+    pending = _pending.get(key)
+    if pending is None:
+        handled = _handled.get(key)
+        if handled is None or now - handled >= DEBOUNCE_WINDOW:
+            return 0
+    if pending is None or pending[0] != fingerprints:
+        _pending[key] = (fingerprints, now)
+        return DEBOUNCE_WINDOW
+
+    return max(DEBOUNCE_WINDOW - (now - pending[1]), 0)
+
+def discard(body):
+    # The spec is back to the last one handled, nothing waits any more
+    _pending.pop(model.object_key(body), None)
+
+def handled(body):
+    key = model.object_key(body)
+    _pending.pop(key, None)
+    _handled[key] = time.monotonic()
+
+def forget(body):
+    key = model.object_key(body)
+    _pending.pop(key, None)
+    _handled.pop(key, None)
@@ -0,0 +1,45 @@
+from collections import namedtuple
+
+# create and delete are lists of spec entries, update is a list of (old, new) pairs
+Diff = namedtuple("Diff", ["create", "update", "delete"])
+
+_MISSING = object()
+
+
+def equal(old, new, ignored):
+    if old == new:
+        return True
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return False
+
+    for field in old.keys() | new.keys():
+        if field not in ignored and old.get(field, _MISSING) != new.get(field, _MISSING):
+            return False
+    return True
+
+def changed(old_entry, new_entry, ignored):
+    # By default the fields the backend writes back are left out (see
+    # model.Entry.IGNORED), otherwise status writes would loop back into the
+    # handlers
+    if ignored is None:
+        ignored = new_entry.IGNORED
+    return not equal(old_entry.raw, new_entry.raw, ignored)
+
+def diff_entries(old_index, new_index, ignored=None):
+    create = []
+    update = []
+    for entry_key, new_entry in new_index.items():
+        old_entry = old_index.get(entry_key, _MISSING)
+        if old_entry is _MISSING:
+            create.append(new_entry)
+        elif changed(old_entry, new_entry, ignored):
+            update.append((old_entry, new_entry))
+
+    delete = [old_entry for entry_key, old_entry in old_index.items() if entry_key not in new_index]
+
+    return Diff(create, update, delete)
+
+def diff_spec(old, new, field, ignored=None):
+    # Compare one spec list ("clusters", "links" or "apps") of two parsed
+    # specs in linear time, matching the entries by their key
+    return diff_entries(getattr(old, field), getattr(new, field), ignored)
@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import os
+import time
+
+import model
+import operations
+import planner
+import scaling
+import writeback
+from providers import registry
+
+# How often the observed state is fetched from the backend, operator-wide
+DRIFT_INTERVAL = float(os.environ.get("DRIFT_INTERVAL", "300"))
+# Operations younger than this are still in progress, not drifted
+DRIFT_GRACE = float(os.environ.get("DRIFT_GRACE", "900"))
+
+# (namespace, name) -> {"name": ..., "clusters": {name: Cluster}, "links": {key: Link}, "apps": {id: App}}
+_desired = {}
+# (namespace, name, kind, key) -> time.monotonic() of the last request sent for it
+_issued = {}
+
+_observed = None
+_observed_at = 0.0
+_observed_lock = None
+
+
+def remember(body):
+    spec = model.parse(body)
+    _desired[model.object_key(body)] = {
+        "name": body["metadata"]["name"],
+        "clusters": spec.clusters,
+        "links": spec.links,
+        "apps": spec.apps,
+    }
+
+def forget(body):
+    key = model.object_key(body)
+    _desired.pop(key, None)
+    for issued in [issued for issued in _issued if issued[:2] == key]:
+        del _issued[issued]
+
+def mark_issued(body, kind, keys):
+    now = time.monotonic()
+    namespace, name = model.object_key(body)
+    for key in keys:
+        _issued[(namespace, name, kind, key)] = now
+
+async def fetch_observed():
+    # Only the cluster providers in use are asked, loading the others is not worth it
+    cluster_types = {
+        cluster.kubernetes_type for desired in _desired.values() for cluster in desired["clusters"].values()
+    }
+    cluster_providers = [registry.get("clusters", name) for name in registry.names("clusters") if name in cluster_types]
+
+    listed = await asyncio.gather(
+        *(provider.method("list_clusters")() for provider in cluster_providers),
+        operations.app_provider().method("list_apps")(),
+    )
+
+    clusters = {}
+    for provider_clusters in listed[:-1]:
+        for cluster in provider_clusters:
+            clusters[cluster["clusterName"]] = cluster
+
+    apps = {app["id"]: app for app in listed[-1]}
+
+    return {"clusters": clusters, "apps": apps}
+
+async def observed():
+    # Every object's timer shares one snapshot, refreshed at most once per
+    # DRIFT_INTERVAL, so the backend sees two list calls per interval however
+    # many objects there are.
+    global _observed, _observed_at, _observed_lock
+
+    if _observed_lock is None:
+        _observed_lock = asyncio.Lock()
+
+    async with _observed_lock:
+        if _observed is None or time.monotonic() - _observed_at >= DRIFT_INTERVAL:
+            try:
+                _observed = await fetch_observed()
+            except Exception as e:
+                logging.warning("Could not fetch the observed state from the backend: %s", e)
+            _observed_at = time.monotonic()
+
+    return _observed
+
+def settled(key, kind, entry_key, now):
+    issued = _issued.get((*key, kind, entry_key))
+    return issued is None or now - issued >= DRIFT_GRACE
+
+def link_states(body):
+    # Recorded state of each link's last rollout, by label
+    progress = (body.get("status") or {}).get(writeback.STATUS_FIELD) or {}
+    return {label: (entry or {}).get("state") for label, entry in (progress.get("links") or {}).items()}
+
+def drifted(body, observed_state):
+    key = model.object_key(body)
+    desired = _desired.get(key)
+    if desired is None:
+        return [], [], [], []
+
+    now = time.monotonic()
+    create_clusters = []
+    update_clusters = []
+    relink = []
+    install_apps = []
+    # Nothing is placed on or linked to clusters in status error
+    broken = {name for name, cluster in desired["clusters"].items() if cluster.status == "error"}
+
+    for name, cluster in desired["clusters"].items():
+        if name in broken or not settled(key, "clusters", name, now):
+            continue
+
+        current = observed_state["clusters"].get(name)
+        if current is None:
+            create_clusters.append(cluster)
+        elif scaling.scalable(cluster) and (current.get("controlPlaneCount") != cluster.control_plane_count
+                                            or current.get("workerMachineCount") != cluster.worker_machine_count):
+            update_clusters.append(cluster)
+
+    # The backend does not list links: those of recreated clusters are sent
+    # again, and those whose last rollout failed or did not finish
+    recreated = {cluster.name for cluster in create_clusters}
+    states = link_states(body)
+    for link in desired["links"].values():
+        if broken.intersection(link.key) or not settled(key, "links", link.label, now):
+            continue
+        if recreated.intersection(link.key) or states.get(link.label) not in (None, "ready"):
+            relink.append(link)
+
+    for app_id, app in desired["apps"].items():
+        if not settled(key, "apps", app_id, now) or app_id in observed_state["apps"]:
+            continue
+        if broken.intersection(planner.app_clusters(body, app, set(desired["clusters"]))):
+            continue
+        install_apps.append(app)
+
+    return create_clusters, update_clusters, relink, install_apps
+
+async def reconcile(body):
+    # Re-send only the operations whose effect is missing from the backend
+    key = model.object_key(body)
+    if key not in _desired:
+        remember(body)
+    if planner.busy(body):
+        # A rollout still running sends what is missing itself
+        return
+
+    observed_state = await observed()
+    if observed_state is None:
+        return
+
+    # Apps have no ready signal of their own; being listed by the backend is it
+    for app_id in _desired[key]["apps"]:
+        if app_id in observed_state["apps"]:
+            writeback.record(body, "apps", app_id, "ready")
+
+    create_clusters, update_clusters, links, install_apps = drifted(body, observed_state)
+    llorch_name = _desired[key]["name"]
+
+    if create_clusters:
+        logging.info("Lowlevel Orchestration %s drifted, recreating %d clusters", llorch_name, len(create_clusters))
+    for cluster in update_clusters:
+        logging.info("Lowlevel Orchestration %s drifted, rescaling cluster %s", llorch_name, cluster.name)
+    if links:
+        logging.info("Lowlevel Orchestration %s drifted, relinking %d links", llorch_name, len(links))
+    if install_apps:
+        logging.info("Lowlevel Orchestration %s drifted, reinstalling %d apps", llorch_name, len(install_apps))
+
+    await asyncio.gather(*(operations.scale_cluster(body, cluster) for cluster in update_clusters))
+    # Recreated clusters go through the rollout like new ones, so their
+    # links and apps wait until they are ready again
+    if create_clusters or links or install_apps:
+        planner.start(body, planner.rollout_plan(body, create_clusters, links, install_apps), "drift", None)
+
+    mark_issued(body, "clusters", [cluster.name for cluster in create_clusters + update_clusters])
+    mark_issued(body, "links", [link.label for link in links])
+    mark_issued(body, "apps", [app.id for app in install_apps])
@@ -0,0 +1,41 @@
+import hashlib
+import json
+
+# Where the fingerprints of the last handled spec are kept in the object.
+# The status is not part of what kopf compares, so writing it does not
+# trigger another update.
+STATUS_FIELD = "fingerprints"
+
+
+def fingerprint(entry, ignored=frozenset()):
+    if isinstance(entry, dict) and ignored:
+        entry = {field: value for field, value in entry.items() if field not in ignored}
+
+    encoded = json.dumps(entry, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(encoded.encode()).hexdigest()[:16]
+
+def spec_fingerprints(spec):
+    # Stable content hash of every cluster and app of a parsed spec (status
+    # fields excluded) plus one hash for the whole list of links.
+    return {
+        "clusters": {str(key): cluster.fingerprint for key, cluster in spec.clusters.items()},
+        "apps": {str(key): app.fingerprint for key, app in spec.apps.items()},
+        "links": spec.links_fingerprint,
+    }
+
+def stored_fingerprints(body):
+    return (body.get("status") or {}).get(STATUS_FIELD)
+
+def unchanged(body, fingerprints):
+    return stored_fingerprints(body) == fingerprints
+
+def store(patch, body, fingerprints):
+    # The status is merge-patched, so entries gone from the spec are nulled out explicitly
+    stored = stored_fingerprints(body) or {}
+    value = {"links": fingerprints["links"]}
+
+    for field in ("clusters", "apps"):
+        value[field] = dict.fromkeys(stored.get(field) or {})
+        value[field].update(fingerprints[field])
+
+    patch.status[STATUS_FIELD] = value
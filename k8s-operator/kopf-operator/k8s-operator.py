@@ -1,16 +1,22 @@
+import asyncio
 import kopf
 import logging
-import kubernetes
-from prometheus_client import start_http_server, Gauge, Counter
-import config
-import os
-
-# METRICS DEFINITION
-
-num_clusters = Gauge('clusters_num', 'Number of currently running clusters in all providers')
-num_providers = Gauge('providers_num', 'Number of currently running providers within ClusterAPI')
-num_apps = Gauge('apps_num', 'Number of currently deployed apps via the orchestrator')
-num_components = Gauge('components_num', 'Number of currently deployed components via the orchestrator')
+from prometheus_client import start_http_server
+import callbacks
+import debounce
+import diffing
+import drift
+import fingerprints
+import logs
+import metrics
+import model
+import operations
+import planner
+import readiness
+import scaling
+import sharding
+import teardown
+import writeback
 
 def init_prometheus():
     # Start up the server to expose the metrics.
@@ -19,26 +25,72 @@ def init_prometheus():
     logging.info("PROMETHEUS UP AND RUNNING...")
 
 @kopf.on.startup()
-def operator_init(settings: kopf.OperatorSettings,logger, **kwargs):
+async def operator_init(settings: kopf.OperatorSettings,logger, **kwargs):
     settings.persistence.progress_storage = kopf.StatusProgressStorage(field='status.kopf')
+    # Log records are written by a thread of their own from here on
+    logs.setup()
+    debounce.setup()
     logging.info("STARTING OPERATOR!!!")
 
-
-    # Load Kubernetes configuration from default location
-    kubernetes.config.load_kube_config(os.environ["KUBECONFIG"])
-    # Create Kubernetes API client
-    api_client = kubernetes.client.ApiClient()
-    api_instance = kubernetes.client.CustomObjectsApi(api_client)
-    api_response = api_instance.list_cluster_custom_object(
-        group="charity-project.eu",
-        version="v1",
-        plural="lowlevelorchestrations"
-    )
-
+    # Metrics and caches are warmed up by llorchestration_seen as kopf lists the
+    # existing objects, so startup does not wait for a list of the whole fleet.
     init_prometheus()
 
-    for resource in api_response["items"]:
-        check_metrics(resource)
+    # The orch-backend reports finished operations here, if configured
+    await callbacks.start()
+
+    # Replicas split the objects between them through Leases (see sharding.py)
+    # instead of pausing each other through kopf's peering
+    if sharding.enabled():
+        settings.peering.standalone = True
+        settings.persistence.finalizer = sharding.FINALIZER
+        await sharding.start()
+
+@kopf.on.cleanup()
+async def operator_cleanup(**kwargs):
+    await callbacks.stop()
+    await sharding.stop()
+    logs.stop()
+
+def forget(body):
+    # Drop everything kept in memory about an object
+    planner.cancel(body)
+    callbacks.forget(body)
+    readiness.forget(body)
+    debounce.forget(body)
+    writeback.forget(body)
+    drift.forget(body)
+    metrics.forget(body)
+    model.forget(body)
+
+@kopf.on.event("lowlevelorchestrations") # type: ignore
+async def llorchestration_seen(event, body, **kwargs):
+    logs.bind(body)
+    if event["type"] == "DELETED":
+        # Nothing is kept about objects gone from the cluster
+        sharding.release(body)
+        forget(body)
+        return
+
+    if not sharding.owns(body):
+        # Handled by another replica, possibly since the last rebalance
+        if sharding.release(body):
+            forget(body)
+        return
+
+    try:
+        # Cluster statuses written by the backend wake up the rollouts waiting for them
+        readiness.observe(body)
+
+        # kopf's watch stream starts with the existing objects, with no event type,
+        # and objects taken over from another replica show up with their next event
+        adopted = sharding.adopt(body)
+        if event["type"] is None or adopted:
+            metrics.observe(body)
+            drift.remember(body)
+    except model.InvalidSpec:
+        # Reported by the create and update handlers, which give up on it
+        pass
 
 # kubernetes_config.load_kube_config()
 # api = kubernetes_client.CoreV1Api()
@@ -89,438 +141,134 @@ def operator_init(settings: kopf.OperatorSettings,logger, **kwargs):
 
 #-----------------------WEBHOOKS-----------------------
 
-@kopf.on.create("lowlevelorchestrations") # type: ignore
-def llorchestration_create(body, **kwargs):
+@kopf.on.create("lowlevelorchestrations", when=sharding.owns) # type: ignore
+@metrics.timed("create")
+async def llorchestration_create(body, patch, **kwargs):
     # logging.info("CLUSTER CREATED!!!")
-    llorch_name = body["metadata"]["name"]
-    
-    if "spec" in body and "clusters" in body["spec"]:
-        clusters = body["spec"]["clusters"]
-    else:
-        clusters = []
-    
-    for cluster in clusters:
-        cluster_name = cluster["name"]
-        provider = cluster["kubernetes-type"]
-
-        clusterData = {
-            "clusterName":  cluster_name,
-            "kubernetesType": "kubeadm",
-            "kubernetesVersion": cluster["kubernetes-version"],
-            "controlPlaneCount": cluster["control-plane-count"],
-            "controlPlaneFlavor": cluster["control-plane-flavor"],
-            "workerMachineCount": cluster["worker-machine-count"],
-            "workerMachineFlavor": cluster["worker-machine-flavor"],
-            "image": cluster["image"],
-            "status": cluster["status"],
-            "datacenter": cluster["datacenter"]
-        }
-
-        logging.info(clusterData)
-        # if cluster["provider"] != "external":
-        provider_module = config.PROVIDERS[provider]
-        provider_module.create_cluster(clusterData)
-        logging.info(f"Lowlevel Orchestration cluster created {clusterData}")
-    # else:
-        logging.info(f"Cluster {cluster_name} added to the CRD")
-
-    if "spec" in body and "links" in body["spec"]:
-        links = body["spec"]["links"]
-    else:
-        links = []
-
-    for link in links:
-        
-        linkData = {
-            "greenClusterName":  link[0],
-            "roseClusterName":  link[1]
-        }
+    logs.bind(body)
 
-        link_module = config.LINKS["liqo"]
-        link_module.link_clusters(linkData)
-        
-        logging.info(f"Lowlevel Orchestration link created {linkData}")
-    
+    # Already parsed for the watch event that brought the object
+    spec = model.parse(body)
+    clusters = list(spec.clusters.values())
+    links = list(spec.links.values())
+    apps = list(spec.apps.values())
 
-    if "spec" in body and "apps" in body["spec"]:
-        apps = body["spec"]["apps"]
-    else:
-        apps = []
-
-    for app in apps:   
-        appData = {
-            "name": app["name"],
-            "owner": app["owner"],
-            "cluster":  app["cluster"],
-            "components": app["components"],
-            "id": app["id"],
-            "status": app["status"],
-            "crd_name": llorch_name
-        }
-
-        # logging.info(appData)        
-
-        app_module = config.APPS["apps"]
-        app_module.install_app(appData)
-        
-        logging.info(f"Lowlevel Orchestration app created {appData}")
+    # Links and apps start as soon as the clusters they reference are ready
+    plan = planner.rollout_plan(body, clusters, links, apps)
+    planner.start(body, plan, "create", body["metadata"].get("creationTimestamp"))
+    for cluster in clusters:
+        logging.info("Cluster %s added to the CRD", cluster.name)
 
-    check_metrics(body)
-@kopf.on.delete("lowlevelorchestrations") # type: ignore
-def llorchestration_delete(body, old, new, **kwargs):
+    drift.remember(body)
+    drift.mark_issued(body, "clusters", list(spec.clusters))
+    drift.mark_issued(body, "links", [link.label for link in links])
+    drift.mark_issued(body, "apps", list(spec.apps))
 
-    changes_clusters = diff_clusters(old, new)
-    change_apps = diff_apps(old, new)
+    fingerprints.store(patch, body, fingerprints.spec_fingerprints(spec))
+    metrics.observe(body)
 
+@kopf.on.delete("lowlevelorchestrations", when=sharding.holds) # type: ignore
+@metrics.timed("delete")
+async def llorchestration_delete(body, **kwargs):
+    logs.bind(body)
     llorch_name = body["metadata"]["name"]
-    
-    if len(change_apps['delete']) >= 1:
-        for app in change_apps['delete']:
-            app_module = config.APPS["apps"]
-            appData = {
-                "name": app["name"],
-                "cluster":   app["cluster"],
-                "id": app["id"] 
-            }
-
-            app_module.uninstall_app(appData)
-
-            logging.info(f"Lowlevel Orchestration app deleted {appData}")
-    else:
-        logging.info("Skipping deletion of the whole CRD")
-
-    if len(changes_clusters['delete']) >= 1:
-        for cluster in changes_clusters['delete']:
-            cluster_name = cluster["name"]
-            provider = cluster["kubernetes-type"]
-            if cluster["status"] == "error":
-                logging.info("Skipping deletion of the whole CRD")
-            else: 
-                provider_module = config.PROVIDERS[provider]
-                provider_module.delete_cluster(cluster_name, cluster["datacenter"])
-                logging.info(f"Lowlevel Orchestration delete {provider} {provider_module}")
-    else:
-        logging.info("Skipping deletion of the whole CRD")
-    
-    check_metrics(body)
 
+    # Nothing new is started while the orchestration is torn down. The
+    # finalizer stays until the backend has confirmed every removal.
+    planner.cancel(body)
+    await teardown.teardown(body)
+    logging.info("Lowlevel Orchestration %s torn down", llorch_name)
 
-@kopf.on.update("lowlevelorchestrations") # type: ignore
-def llorchestration_update(body, spec, old, new, diff, **_kwargs):
-    
+    forget(body)
+    sharding.release(body)
+    metrics.reconciled("delete", body["metadata"].get("deletionTimestamp"))
+
+
+@kopf.on.update("lowlevelorchestrations", when=sharding.owns) # type: ignore
+@metrics.timed("update", untimed=debounce.Waiting)
+async def llorchestration_update(body, spec, old, new, diff, patch, started, **_kwargs):
     
+    logs.bind(body)
     llorch_name = body["metadata"]["name"]
-    change = False
+
+    # The body holds the new spec. Changes to the entries' status fields
+    # alone leave the fingerprints as they were.
+    new_spec = model.parse(body)
+    new_fingerprints = fingerprints.spec_fingerprints(new_spec)
+    if fingerprints.unchanged(body, new_fingerprints):
+        logging.info("Lowlevel Orchestration %s spec unchanged, skipping", llorch_name)
+        drift.remember(body)
+        debounce.discard(body)
+        return
+
+    # Let bursts of patches settle and handle their net change once
+    wait = debounce.remaining(body, new_fingerprints)
+    if wait > 0:
+        raise debounce.Waiting(llorch_name, wait)
+    debounce.handled(body)
         
-    changes_clusters = diff_clusters(old, new)
-    change_apps = diff_apps(old, new)
+    # The last spec handled, possibly one that was rejected as invalid
+    old_spec = model.parse(old, strict=False)
+    changes_clusters = diffing.diff_spec(old_spec, new_spec, "clusters")
+    change_apps = diffing.diff_spec(old_spec, new_spec, "apps")
 
-    changes_links = diff_links(old, new)
+    changes_links = diffing.diff_spec(old_spec, new_spec, "links")
 
 
     #logging.info(changes_links)
 
     # logging.info(change_apps)
 
-    for app in change_apps['create']:
-        appData = {
-            "name": app["name"],
-            "owner": app["owner"],
-            "cluster":  app["cluster"],
-            "components": app["components"],
-            "id" : app["id"],
-            "crd_name": llorch_name
-        }
+    # Removals go in the reverse of the rollout order, each stage once the
+    # one before is done: the apps, then the links, then the clusters. Scale
+    # changes go along with the first stage; the work queue keeps them in
+    # order with the apps on the same cluster. New clusters, links and apps
+    # are rolled out in dependency order afterwards.
+    scale_changes = scaling.scale_changes(changes_clusters.update)
+    await asyncio.gather(
+        scaling.apply(body, scale_changes, patch),
+        *(operations.uninstall_app(body, app) for app in change_apps.delete)
+    )
 
-        # logging.info(appData)        
+    await asyncio.gather(*(operations.unlink_clusters(body, link) for link in changes_links.delete))
+    for link in changes_links.delete:
+        writeback.record(body, "links", link.label, "deleted")
 
-        app_module = config.APPS["apps"]
-        app_module.install_app(appData)
-        
-        logging.info(f"Lowlevel Orchestration app created {appData}")
-
-    for app in change_apps['delete']:
-        app_module = config.APPS["apps"]
-        appData = {
-            "name": app["name"],
-            "cluster":  app["cluster"],
-            "id": app["id"] 
-        }
-
-        logging.info(appData)
-        app_module.uninstall_app(appData)
-
-        logging.info(f"Lowlevel Orchestration app deleted {appData}")
-
-    for cluster in changes_clusters['create']:
-        provider = cluster["kubernetes-type"]
-        provider_module = config.PROVIDERS[provider]
-        cluster_name = cluster["name"]
-        clusterData = {
-                        "clusterName":  cluster["name"],
-                        "kubernetesType": "kubeadm",
-                        "kubernetesVersion": cluster["kubernetes-version"],
-                        "controlPlaneCount": cluster["control-plane-count"],
-                        "controlPlaneFlavor": cluster["control-plane-flavor"],
-                        "workerMachineCount": cluster["worker-machine-count"],
-                        "workerMachineFlavor": cluster["worker-machine-flavor"],
-                        "image": cluster["image"],
-                        "datacenter": cluster["datacenter"]
-
-                    }
-
-        # if cluster["provider"] != "external":
-        provider_module = config.PROVIDERS[provider]
-        provider_module.create_cluster(clusterData)
-        logging.info(f"Lowlevel Orchestration cluster created {clusterData}")
-    # else:
-        logging.info(f"Cluster {cluster_name} added to the CRD")
-        
-        logging.info(f"Lowlevel Orchestration resource created {provider} {provider_module}")
-        
-    for old_cluster in changes_clusters['update']['old']:
-        for new_cluster in changes_clusters['update']['new']:
-            change = False
-            provider = new_cluster['kubernetes-type']
-            provider_module = config.PROVIDERS[provider]
-            
-            if new_cluster['control-plane-count'] != old_cluster['control-plane-count']:
-                change = True
-                
-            elif new_cluster['worker-machine-count'] != old_cluster['worker-machine-count']:
-                change = True
-            
-            if change == True:
-                clusterData = {
-                        "clusterName":  new_cluster["name"],
-                        "kubernetesType": "kubeadm",
-                        "kubernetesVersion": new_cluster["kubernetes-version"],
-                        "controlPlaneCount": new_cluster["control-plane-count"],
-                        "controlPlaneFlavor": new_cluster["control-plane-flavor"],
-                        "workerMachineCount": new_cluster["worker-machine-count"],
-                        "workerMachineFlavor": new_cluster["worker-machine-flavor"],
-                        "image": new_cluster["image"]
-                    }
-                if new_cluster["provider"] != "external":
-                    provider_module.update_cluster(clusterData)
-
-                else:
-                    logging.info(f"Cluster {cluster_name} added to the CRD")
-
-    for cluster in changes_clusters['delete']:
-        cluster_name = cluster["name"]
-        provider = cluster["kubernetes-type"]
-        if cluster["status"] == "error":
+    cluster_work = []
+    for cluster in changes_clusters.delete:
+        cluster_name = cluster.name
+        if cluster.status == "error":
             logging.info("Skipping deletion of the whole CRD")
         else:  
             
             # if cluster["provider"] != "external":
-            provider_module = config.PROVIDERS[provider]
-            provider_module.delete_cluster(cluster_name, cluster["datacenter"])
-            logging.info(f"Lowlevel Orchestration delete {provider} {provider_module}")
+            cluster_work.append(operations.delete_cluster(body, cluster))
         # else:
-            logging.info(f"Cluster {cluster_name} added to the CRD")
-
-                
+            logging.info("Cluster %s added to the CRD", cluster_name)
 
-    for links in changes_links['create']:
-        linkData = {
-            "greenClusterName":  links[0],
-            "roseClusterName":  links[1]
-        }
+    await asyncio.gather(*cluster_work)
+    for app in change_apps.delete:
+        writeback.record(body, "apps", app.id, "deleted")
+        logging.info("Lowlevel Orchestration app deleted %s", app.name)
+    for cluster in changes_clusters.delete:
+        writeback.record(body, "clusters", cluster.name, "deleted")
 
-        link_module = config.LINKS["liqo"]
-        link_module.link_clusters(linkData)
+    plan = planner.rollout_plan(body, changes_clusters.create, changes_links.create, change_apps.create)
+    planner.start(body, plan, "update", started)
 
-    check_metrics(body)
+    drift.remember(body)
+    drift.mark_issued(body, "clusters", [cluster.name for cluster in changes_clusters.create])
+    drift.mark_issued(body, "clusters", [change.name for change in scale_changes])
+    drift.mark_issued(body, "links", [link.label for link in changes_links.create])
+    drift.mark_issued(body, "apps", [app.id for app in change_apps.create])
 
+    fingerprints.store(patch, body, new_fingerprints)
+    metrics.observe(body)
 
 
-def diff_clusters(old, new):
-    if "spec" in old and "clusters" in old['spec']:
-        old_clusters = old['spec']['clusters']
-    else:
-        old_clusters = {}
-    
-    if "spec" in new and "clusters" in new['spec']:
-        new_clusters = new['spec']['clusters']
-    else:
-        new_clusters = {}
-    
-    create_clusters = []
-    update_clusters = {'old': [], 'new': []}
-    delete_clusters = []
-
-    # Check for create and update clusters
-    for new_cluster in new_clusters:
-        match_found = False
-        for old_cluster in old_clusters:
-            if new_cluster['name'] == old_cluster['name']:
-                match_found = True
-                
-                # Extract the status to ignore changes in it
-                new_cluster_status= new_cluster.pop("status")
-                old_cluster_status= old_cluster.pop("status")
-
-                # If the change in the cluster is just the status, ignore to avoid loops: 
-                if new_cluster != old_cluster:
-                 
-                    update_clusters['old'].append(old_cluster)
-                    update_clusters['new'].append(new_cluster)
-                
-                #Put the status back
-                new_cluster['status'] = new_cluster_status
-                old_cluster['status'] = old_cluster_status
-                break
-        if not match_found:
-            create_clusters.append(new_cluster)
-
-    # Check for delete clusters
-    for old_cluster in old_clusters:
-        match_found = False
-        for new_cluster in new_clusters:
-            if old_cluster['name'] == new_cluster['name']:
-                match_found = True
-                break
-        if not match_found and len(old_cluster) > 1:
-            delete_clusters.append(old_cluster)
-
-    diff = {
-        'create': create_clusters,
-        'update': update_clusters,
-        'delete': delete_clusters
-    }
-
-    return diff
-
-def diff_links(old, new):
-    if "spec" in old and "links" in old['spec']:
-        old_links = old['spec']['links']
-    else:
-        old_links = []
-
-    if "spec" in new and "links" in new['spec']:
-        new_links = new['spec']['links']
-    else:
-        new_links = []
-
-    create_links = []
-    update_links = {'old': [], 'new': []}
-    delete_links = []
-
-    # Check for create and update links
-    for new_link in new_links:
-        match_found = False
-        for old_link in old_links:
-            if new_link[0] == old_link[0]:
-                match_found = True
-                if new_link[1] != old_link[1]:
-                    update_links['old'].append(old_link)
-                    update_links['new'].append(new_link)
-                break
-        if not match_found:
-            create_links.append(new_link)
-
-    # Check for delete links
-    for old_link in old_links:
-        match_found = False
-        for new_link in new_links:
-            if old_link[0] == new_link[0]:
-                match_found = True
-                break
-        if not match_found:
-            delete_links.append(old_link)
-
-    diff = {
-        'create': create_links,
-        'update': update_links,
-        'delete': delete_links
-    }
-
-    return diff
-
-def diff_apps(old, new):
-    if "spec" in old and "apps" in old['spec']:
-        old_apps = old['spec']['apps']
-    else:
-        old_apps = []
-
-    if "spec" in new and "apps" in new['spec']:
-        new_apps = new['spec']['apps']
-    else:
-        new_apps = []
-
-    create_apps = []
-    update_apps = {'old': [], 'new': []}
-    delete_apps = []
-
-    for new_app in new_apps:
-        match_found = False
-        for old_app in old_apps:
-            if new_app["id"] == old_app["id"]:
-                match_found = True
-                new_app_status= new_app.pop("status")
-                old_app_status= old_app.pop("status")
-
-                # If the change in the app is just the status, ignore to avoid loops: 
-                if new_app != old_app:
-                 
-                    update_apps['old'].append(old_app)
-                    update_apps['new'].append(new_app)
-                
-                #Put the status back
-                new_app['status'] = new_app_status
-                old_app['status'] = old_app_status
-                break
-        if not match_found:
-            create_apps.append(new_app)
-
-    # Check for delete apps
-    for old_app in old_apps:
-        match_found = False
-        for new_app in new_apps:
-            if old_app["id"] == new_app["id"]:
-                match_found = True
-                break
-        if not match_found:
-            delete_apps.append(old_app)
-
-    diff = {
-        'create': create_apps,
-        'update': update_apps,
-        'delete': delete_apps
-    }
-
-    return diff
-    
-def check_metrics(body):
-    if body:
-        apps = []
-        clusters = []
-        components = 0
-        providers = []
-
-        
-        if "spec" in body:
-            if "clusters" in body["spec"]:
-                clusters = body["spec"]["clusters"]
-                for cluster in clusters:
-                    if "kubernetes-type" in cluster:
-                        providers.append(cluster["kubernetes-type"])
-            if "apps" in body["spec"]:
-                apps = body["spec"]["apps"]
-            
 
-            for app in apps:
-                if "components" in app:
-                    components += len(app["components"])
-
-        num_clusters.set(len(clusters))
-        num_apps.set(len(apps))
-        num_components.set(components)
-        num_providers.set(len(set(providers)))
-    else:
-        num_providers.set(0)
-        num_clusters.set(0)
-        num_apps.set(0)
-        num_components.set(0)
\ No newline at end of file
+@kopf.timer("lowlevelorchestrations", interval=drift.DRIFT_INTERVAL, initial_delay=drift.DRIFT_INTERVAL, when=sharding.owns) # type: ignore
+async def llorchestration_drift(body, **kwargs):
+    # Converge on the desired state when backend operations did not take effect
+    logs.bind(body)
+    await drift.reconcile(body)
@@ -0,0 +1,18 @@
+import os
+
+import kubernetes
+
+_client = None
+
+
+def get_client():
+    global _client
+
+    if _client is None:
+        # Load Kubernetes configuration the same way kopf does
+        if "KUBECONFIG" in os.environ:
+            kubernetes.config.load_kube_config(os.environ["KUBECONFIG"])
+        else:
+            kubernetes.config.load_incluster_config()
+        _client = kubernetes.client.ApiClient()
+    return _client
@@ -0,0 +1,171 @@
+# Logging of the operator and its providers. setup() puts a queue in front
+# of the handlers kopf configured: the handlers, the work queue and the
+# provider threads only put records on it, and a thread of its own formats
+# and writes them, so a slow log sink never holds up a reconcile.
+#
+# Each record is tagged with the LowLevelOrchestration it is about, bound by
+# the handlers and carried into the tasks and provider threads they start,
+# the same way kopf tags its own: kopf's formatters prefix the message with
+# the object, or add it to the JSON of `kopf run --log-format=json`.
+# Below WARNING, a message logged more than LOG_RATE_BURST times within
+# LOG_RATE_WINDOW seconds is sampled, one record in LOG_SAMPLE_EVERY, and
+# the next one let through says how many were left out.
+#
+# Messages are logged with %-style arguments, which are only formatted for
+# records that are written.
+
+import contextvars
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+import metrics
+
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+LOG_RATE_WINDOW = float(os.environ.get("LOG_RATE_WINDOW", "10"))
+LOG_RATE_BURST = int(os.environ.get("LOG_RATE_BURST", "20"))
+LOG_SAMPLE_EVERY = int(os.environ.get("LOG_SAMPLE_EVERY", "100"))
+
+# Messages tracked by the rate limit at once; the oldest windows are dropped
+MESSAGES_SIZE = 1000
+
+# Reference to the object being handled, None outside of handlers
+_object = contextvars.ContextVar("llo_object", default=None)
+
+_listener = None
+# Handlers of the root logger before setup(), put back by stop()
+_handlers = []
+
+
+def bind(body):
+    # Every record logged from here on in this task, and in the tasks and
+    # provider threads it starts, is about this object
+    metadata = body.get("metadata") or {}
+    return about(metadata.get("namespace"), metadata.get("name"), metadata.get("uid"))
+
+def about(namespace, name, uid=None):
+    return _object.set({"kind": "LowLevelOrchestration", "namespace": namespace, "name": name, "uid": uid})
+
+def unbind(token):
+    _object.reset(token)
+
+
+class Correlation(logging.Filter):
+    """Tags records with the object they are about, in the thread that logs them."""
+
+    def filter(self, record):
+        ref = _object.get()
+        if ref is not None and not hasattr(record, "k8s_ref"):
+            record.k8s_ref = ref
+        return True
+
+
+class RateLimit(logging.Filter):
+    """Samples messages that are logged over and over."""
+
+    def __init__(self, window=LOG_RATE_WINDOW, burst=LOG_RATE_BURST, sample_every=LOG_SAMPLE_EVERY):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self.sample_every = max(sample_every, 1)
+        # (logger, level, message) -> [window start, records in the window, records left out]
+        self.messages = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.window <= 0:
+            return True
+
+        # The message before formatting, so each call site counts as one message
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self.lock:
+            state = self.messages.get(key)
+            if state is None or now - state[0] > self.window:
+                dropped = state[2] if state is not None else 0
+                if state is None and len(self.messages) >= MESSAGES_SIZE:
+                    self.expire(now)
+                state = self.messages[key] = [now, 0, 0]
+            else:
+                dropped = 0
+            state[1] += 1
+            if state[1] > self.burst and (state[1] - self.burst) % self.sample_every:
+                state[2] += 1
+                metrics.log_records_dropped.labels("rate_limited").inc()
+                return False
+            if state[1] > self.burst:
+                dropped, state[2] = state[2], 0
+
+        if dropped:
+            if isinstance(record.msg, str) and isinstance(record.args, tuple):
+                # Still formatted by the writing thread
+                record.msg += " (%d similar messages left out)"
+                record.args += (dropped,)
+            else:
+                record.msg = f"{record.getMessage()} ({dropped} similar messages left out)"
+                record.args = None
+        return True
+
+    def expire(self, now):
+        for key in [key for key, state in self.messages.items() if now - state[0] > self.window]:
+            del self.messages[key]
+        if len(self.messages) >= MESSAGES_SIZE:
+            self.messages.clear()
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """Drops records instead of waiting when the writer falls behind."""
+
+    def prepare(self, record):
+        # Queued as logged: the message, its arguments and the traceback are
+        # formatted by kopf's handlers in the writing thread. The stdlib
+        # formats them here, in the thread that logs.
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.log_records_dropped.labels("queue_full").inc()
+
+
+def setup():
+    # Called once kopf has configured logging, at startup
+    global _listener, _handlers
+
+    if _listener is not None:
+        return
+
+    root = logging.getLogger()
+    _handlers = list(root.handlers)
+
+    # Filtered in the thread that logs, which has the context; kopf's
+    # handlers format the records in the writing thread
+    handler = QueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(Correlation())
+    handler.addFilter(RateLimit())
+
+    _listener = logging.handlers.QueueListener(handler.queue, *_handlers, respect_handler_level=True)
+    for previous in _handlers:
+        root.removeHandler(previous)
+    root.addHandler(handler)
+    _listener.start()
+
+def stop():
+    # Writes what is queued and logs straight to the handlers again
+    global _listener
+
+    if _listener is None:
+        return
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, QueueHandler):
+            root.removeHandler(handler)
+    for handler in _handlers:
+        root.addHandler(handler)
+    _listener.stop()
+    _listener = None
@@ -0,0 +1,148 @@
+import asyncio
+import datetime
+import functools
+import threading
+import time
+from collections import Counter
+
+from prometheus_client import Counter as CounterMetric, Gauge, Histogram
+
+import model
+
+# METRICS DEFINITION
+
+# Fleet-wide totals
+num_clusters = Gauge('clusters_num', 'Number of currently running clusters in all providers')
+num_providers = Gauge('providers_num', 'Number of currently running providers within ClusterAPI')
+num_apps = Gauge('apps_num', 'Number of currently deployed apps via the orchestrator')
+num_components = Gauge('components_num', 'Number of currently deployed components via the orchestrator')
+
+# Per LowLevelOrchestration
+LABELS = ['namespace', 'name']
+llorch_clusters = Gauge('llorch_clusters_num', 'Number of clusters of a LowLevelOrchestration', LABELS)
+llorch_providers = Gauge('llorch_providers_num', 'Number of providers used by a LowLevelOrchestration', LABELS)
+llorch_apps = Gauge('llorch_apps_num', 'Number of apps of a LowLevelOrchestration', LABELS)
+llorch_components = Gauge('llorch_components_num', 'Number of components of a LowLevelOrchestration', LABELS)
+
+# Handlers and orch-backend calls
+handler_latency = Histogram('handler_duration_seconds', 'Time spent in a LowLevelOrchestration handler', ['handler'])
+reconcile_latency = Histogram('reconcile_duration_seconds', 'Time from the CR event to the last backend call of its handler',
+                              ['handler'], buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800))
+backend_latency = Histogram('backend_request_duration_seconds', 'Duration of one orch-backend request', ['operation', 'method'])
+backend_requests = CounterMetric('backend_requests', 'Requests sent to the orch-backend by answer code', ['operation', 'method', 'code'])
+backend_retries = CounterMetric('backend_retries', 'Requests to the orch-backend that were retried', ['operation', 'method'])
+backend_in_flight = Gauge('backend_requests_in_flight', 'Requests to the orch-backend waiting for an answer', ['operation'])
+backend_concurrency_limit = Gauge('backend_concurrency_limit', 'Requests the orch-backend is currently allowed to have in flight')
+backend_breaker_state = Gauge('backend_circuit_state', 'Circuit breaker of an orch-backend endpoint: 0 closed, 1 half-open, 2 open',
+                              ['operation'])
+backend_rejected = CounterMetric('backend_rejected', 'Requests not sent because the circuit of their endpoint was open', ['operation'])
+backend_callbacks = CounterMetric('backend_callbacks', 'Completion callbacks received from the orch-backend', ['kind', 'status'])
+log_records_dropped = CounterMetric('log_records_dropped', 'Log records not written, sampled out or with the log queue full', ['reason'])
+
+# (namespace, name) -> (clusters, apps, components, Counter of clusters per provider)
+_counts = {}
+# Clusters per provider across all objects; providers_num is the number of keys
+_providers = Counter()
+_lock = threading.Lock()
+
+
+def object_labels(body):
+    namespace, name = model.object_key(body)
+    return (namespace or "", name)
+
+def count(spec):
+    providers = Counter(
+        cluster.kubernetes_type for cluster in spec.clusters.values() if cluster.kubernetes_type is not None
+    )
+    components = sum(app.component_count for app in spec.apps.values())
+
+    return (len(spec.clusters), len(spec.apps), components, providers)
+
+def apply(labels, counts):
+    # Move the fleet totals by the difference between the object's old and
+    # new counts, so each event costs the same however many objects exist.
+    old = _counts.pop(labels, (0, 0, 0, Counter()))
+    if counts is not None:
+        _counts[labels] = counts
+    new = counts or (0, 0, 0, Counter())
+
+    num_clusters.inc(new[0] - old[0])
+    num_apps.inc(new[1] - old[1])
+    num_components.inc(new[2] - old[2])
+
+    _providers.update(new[3])
+    _providers.subtract(old[3])
+    for provider in [provider for provider, clusters in _providers.items() if clusters <= 0]:
+        del _providers[provider]
+    num_providers.set(len(_providers))
+
+def observe(body):
+    labels = object_labels(body)
+    counts = count(model.parse(body))
+
+    with _lock:
+        apply(labels, counts)
+
+    llorch_clusters.labels(*labels).set(counts[0])
+    llorch_apps.labels(*labels).set(counts[1])
+    llorch_components.labels(*labels).set(counts[2])
+    llorch_providers.labels(*labels).set(len(counts[3]))
+
+def forget(body):
+    labels = object_labels(body)
+
+    with _lock:
+        apply(labels, None)
+
+    for gauge in (llorch_clusters, llorch_apps, llorch_components, llorch_providers):
+        try:
+            gauge.remove(*labels)
+        except KeyError:
+            pass
+
+def timed(handler, untimed=()):
+    # Decorator observing the duration of a sync or async kopf handler. Calls
+    # ending with one of the untimed exceptions did no work and are left out.
+    def decorator(fn):
+        histogram = handler_latency.labels(handler)
+
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                except untimed:
+                    start = None
+                    raise
+                finally:
+                    if start is not None:
+                        histogram.observe(time.perf_counter() - start)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                except untimed:
+                    start = None
+                    raise
+                finally:
+                    if start is not None:
+                        histogram.observe(time.perf_counter() - start)
+
+        return wrapper
+    return decorator
+
+def reconciled(handler, event_time, done_at=None):
+    # event_time is a Kubernetes timestamp string or a datetime from kopf (naive
+    # means UTC); done_at, when the last backend call returned, defaults to now
+    if not event_time:
+        return
+    if isinstance(event_time, str):
+        event_time = datetime.datetime.fromisoformat(event_time.replace("Z", "+00:00"))
+    if event_time.tzinfo is None:
+        event_time = event_time.replace(tzinfo=datetime.timezone.utc)
+
+    elapsed = (done_at or datetime.datetime.now(datetime.timezone.utc)) - event_time
+    reconcile_latency.labels(handler).observe(max(elapsed.total_seconds(), 0))
@@ -0,0 +1,242 @@
+# Typed view of a LowLevelOrchestration spec. Each object's spec is parsed
+# and validated once per resourceVersion, and the entries are shared by the
+# handlers, the diffing, the metrics and the payloads sent to the backend.
+# The entries keep the dicts they were parsed from, nothing is copied.
+
+import kopf
+
+import diffing
+import fingerprints
+
+# (namespace, name) -> (resourceVersion, Spec) of the last version parsed
+_parsed = {}
+
+
+class InvalidSpec(kopf.PermanentError):
+    pass
+
+
+class Entry:
+    __slots__ = ("key", "raw", "_fingerprint")
+
+    # Fields written back by the backend; changes in them alone are not an
+    # update, otherwise status writes would loop back into the handlers
+    IGNORED = frozenset({"status"})
+
+    @property
+    def fingerprint(self):
+        # Content hash of the entry without its ignored fields, computed once
+        if self._fingerprint is None:
+            self._fingerprint = fingerprints.fingerprint(self.raw, self.IGNORED)
+        return self._fingerprint
+
+    def inherit(self, previous):
+        # Take the fingerprint of the entry in the previous version of the
+        # spec if only ignored fields changed, which is cheaper than hashing
+        if previous is not None and previous._fingerprint is not None and \
+                diffing.equal(previous.raw, self.raw, self.IGNORED):
+            self._fingerprint = previous._fingerprint
+
+
+class Component(Entry):
+    __slots__ = ("name", "cluster_selector", "image")
+
+    def __init__(self, raw):
+        self.raw = mapping(raw, "component")
+        self._fingerprint = None
+        self.name = raw.get("name")
+        self.key = self.name
+        self.cluster_selector = raw.get("cluster-selector")
+        self.image = raw.get("image")
+
+
+class Cluster(Entry):
+    __slots__ = ("name", "kubernetes_type", "provider", "kubernetes_version", "control_plane_count",
+                 "control_plane_flavor", "worker_machine_count", "worker_machine_flavor", "image", "datacenter",
+                 "status")
+
+    def __init__(self, raw):
+        self.raw = mapping(raw, "cluster")
+        self._fingerprint = None
+        self.name = required(raw, "name", "cluster")
+        self.key = self.name
+        self.kubernetes_type = raw.get("kubernetes-type")
+        self.provider = raw.get("provider")
+        self.kubernetes_version = raw.get("kubernetes-version")
+        self.control_plane_count = machine_count(raw, "control-plane-count", self.name)
+        self.control_plane_flavor = raw.get("control-plane-flavor")
+        self.worker_machine_count = machine_count(raw, "worker-machine-count", self.name)
+        self.worker_machine_flavor = raw.get("worker-machine-flavor")
+        self.image = raw.get("image")
+        self.datacenter = raw.get("datacenter")
+        self.status = raw.get("status")
+
+
+class Link(Entry):
+    __slots__ = ("green", "rose", "label")
+
+    IGNORED = frozenset()
+
+    def __init__(self, raw):
+        if not isinstance(raw, (list, tuple)) or len(raw) != 2 or not all(isinstance(name, str) for name in raw):
+            raise InvalidSpec(f"Link {raw!r} is not a pair of cluster names")
+        self.raw = raw
+        self._fingerprint = None
+        self.green, self.rose = raw
+        self.key = (self.green, self.rose)
+        # How the link is named in the status and the logs
+        self.label = f"{self.green}/{self.rose}"
+
+
+class App(Entry):
+    __slots__ = ("id", "name", "owner", "cluster", "status", "component_count", "_components")
+
+    def __init__(self, raw):
+        self.raw = mapping(raw, "app")
+        self._fingerprint = None
+        self.id = required(raw, "id", "app")
+        self.key = self.id
+        self.name = raw.get("name")
+        self.owner = raw.get("owner")
+        self.cluster = raw.get("cluster")
+        self.status = raw.get("status")
+        self.component_count = len(raw.get("components") or ())
+        self._components = None
+
+    @property
+    def components(self):
+        # Only the planner looks into the components, they are parsed then
+        if self._components is None:
+            self._components = tuple(map(Component, self.raw.get("components") or []))
+        return self._components
+
+
+class Spec:
+    """The clusters, links and apps of one spec, each indexed by its key.
+
+    Each list is parsed the first time it is used: the status writes of the
+    backend, the most frequent events, only need the clusters. Entries that
+    did not change since the previous version keep their fingerprints.
+    """
+
+    __slots__ = ("raw", "strict", "previous", "_clusters", "_links", "_apps", "_links_fingerprint")
+
+    def __init__(self, raw, strict=True, previous=None):
+        self.raw = raw
+        self.strict = strict
+        self.previous = previous
+        self._clusters = None
+        self._links = None
+        self._apps = None
+        self._links_fingerprint = None
+
+    @property
+    def clusters(self):
+        if self._clusters is None:
+            self._clusters = index(entries(Cluster, self.raw.get("clusters"), self.strict), self.strict)
+            self.inherit(self._clusters, self.previous and self.previous._clusters)
+        return self._clusters
+
+    @property
+    def links(self):
+        # A link listed twice is still one link
+        if self._links is None:
+            self._links = index(entries(Link, self.raw.get("links"), self.strict), False)
+        return self._links
+
+    @property
+    def apps(self):
+        if self._apps is None:
+            self._apps = index(entries(App, self.raw.get("apps"), self.strict), self.strict)
+            self.inherit(self._apps, self.previous and self.previous._apps)
+        return self._apps
+
+    @staticmethod
+    def inherit(indexed, previous):
+        if previous:
+            for key, item in indexed.items():
+                item.inherit(previous.get(key))
+
+    @property
+    def links_fingerprint(self):
+        # One hash for the whole list of links, in any order
+        if self._links_fingerprint is None:
+            self._links_fingerprint = fingerprints.fingerprint(sorted(self.links))
+        return self._links_fingerprint
+
+
+def mapping(raw, kind):
+    if not isinstance(raw, dict):
+        raise InvalidSpec(f"Every {kind} must be a mapping, got {raw!r}")
+    return raw
+
+def required(raw, field, kind):
+    value = raw.get(field)
+    if value is None or value == "":
+        raise InvalidSpec(f"{kind.capitalize()} {raw!r} has no {field}")
+    return value
+
+def machine_count(raw, field, name):
+    value = raw.get(field)
+    if value is not None and (isinstance(value, bool) or not isinstance(value, int) or value < 0):
+        raise InvalidSpec(f"Cluster {name} has an invalid {field}: {value!r}")
+    return value
+
+def entries(cls, raws, strict):
+    # Without strict, the entries that are not valid are left out
+    parsed = []
+    for raw in raws or []:
+        try:
+            parsed.append(cls(raw))
+        except InvalidSpec:
+            if strict:
+                raise
+    return parsed
+
+def index(items, unique):
+    indexed = {}
+    for item in items:
+        if unique and item.key in indexed:
+            raise InvalidSpec(f"{type(item).__name__} {item.key} appears twice in the spec")
+        indexed[item.key] = item
+    return indexed
+
+def object_key(body):
+    return (body["metadata"].get("namespace"), body["metadata"]["name"])
+
+def cluster_name(body, ref, names):
+    # Apps name their cluster either as in the spec or prefixed with the
+    # object name. Returns the name in the spec, or None if ref names none
+    # of the clusters in names.
+    if ref in names:
+        return ref
+    prefix = body["metadata"]["name"] + "-"
+    if ref and ref.startswith(prefix) and ref[len(prefix):] in names:
+        return ref[len(prefix):]
+    return None
+
+def parse(body, strict=True):
+    # Raises InvalidSpec, which kopf does not retry, for a spec the operator
+    # cannot act on. Bodies without a resourceVersion, like the old essence
+    # of an update, are parsed every time; for those, strict=False keeps
+    # what is valid of a spec that was given up on.
+    if not body:
+        return Spec({})
+
+    metadata = body.get("metadata") or {}
+    version = metadata.get("resourceVersion")
+    if version is None or "name" not in metadata or not strict:
+        return Spec(body.get("spec") or {}, strict)
+
+    key = object_key(body)
+    parsed = _parsed.get(key)
+    if parsed is None or parsed[0] != version:
+        previous = parsed and parsed[1]
+        if previous is not None:
+            # Only one version back is kept
+            previous.previous = None
+        parsed = _parsed[key] = (version, Spec(body.get("spec") or {}, previous=previous))
+    return parsed[1]
+
+def forget(body):
+    _parsed.pop(object_key(body), None)
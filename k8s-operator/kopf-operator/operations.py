@@ -0,0 +1,113 @@
+# Backend operations of a LowLevelOrchestration, queued on the work queue.
+# They take the entries of the parsed spec (see model.py), and each function
+# returns a future resolved with the provider's result.
+
+import hashlib
+import json
+
+import callbacks
+import config
+import model
+import payloads
+import workqueue
+from providers import registry
+
+
+def app_lane(body, app):
+    # Work queue lane of an app: its cluster's, so a cluster's apps queue
+    # behind and ahead of the cluster itself, however the app names it
+    names = model.parse(body, strict=False).clusters
+    return model.cluster_name(body, app.cluster, names) or app.cluster
+
+def cluster_provider(cluster):
+    return registry.get("clusters", cluster.kubernetes_type)
+
+def link_provider():
+    return registry.get("links", config.LINK_PROVIDER)
+
+def app_provider():
+    return registry.get("apps", config.APP_PROVIDER)
+
+def idempotency_key(body, action, entry, content):
+    # Same object, action, entry and content: the same operation, however
+    # many times the handlers ask for it. The content is the entry's
+    # fingerprint, which leaves out the status the backend writes back.
+    data = json.dumps([body["metadata"].get("uid"), action, entry, content], sort_keys=True, default=str)
+    return hashlib.sha1(data.encode()).hexdigest()[:32]
+
+def create_cluster(body, cluster):
+    provider = cluster_provider(cluster)
+    clusterData = payloads.cluster_payload(cluster)
+    idempotency = idempotency_key(body, "deploy", cluster.name, cluster.fingerprint)
+    callbacks.expect(body, "clusters", cluster.name, idempotency)
+    return workqueue.submit(
+        cluster.name, (*model.object_key(body), "deploy", cluster.name), workqueue.CREATE,
+        provider.method("create_cluster"), clusterData,
+        idempotency=idempotency
+    )
+
+def scale_cluster(body, cluster):
+    provider = cluster_provider(cluster)
+    clusterData = payloads.cluster_update_payload(cluster)
+    return workqueue.submit(
+        cluster.name, (*model.object_key(body), "scale", cluster.name), workqueue.SCALE,
+        provider.method("update_cluster"), clusterData,
+        idempotency=idempotency_key(body, "scale", cluster.name, cluster.fingerprint)
+    )
+
+def delete_cluster(body, cluster):
+    provider = cluster_provider(cluster)
+    return workqueue.submit(
+        cluster.name, (*model.object_key(body), "delete", cluster.name), workqueue.DELETE,
+        provider.method("delete_cluster"), cluster.name, cluster.datacenter,
+        supersedes=[(*model.object_key(body), "scale", cluster.name)],
+        idempotency=idempotency_key(body, "delete", cluster.name, cluster.datacenter)
+    )
+
+def link_clusters(body, link):
+    provider = link_provider()
+    linkData = payloads.link_payload(link)
+    idempotency = idempotency_key(body, "link", link.key, link.fingerprint)
+    callbacks.expect(body, "links", link.key, idempotency)
+    return workqueue.submit(
+        link.label, (*model.object_key(body), "link", *link.key), workqueue.CREATE,
+        provider.method("link_clusters"), linkData,
+        idempotency=idempotency
+    )
+
+def unlink_clusters(body, link):
+    provider = link_provider()
+    linkData = payloads.link_payload(link)
+    return workqueue.submit(
+        link.label, (*model.object_key(body), "unlink", *link.key), workqueue.DELETE,
+        provider.method("unlink_clusters"), linkData,
+        supersedes=[(*model.object_key(body), "link", *link.key)],
+        idempotency=idempotency_key(body, "unlink", link.key, link.fingerprint)
+    )
+
+def install_app(body, app):
+    provider = app_provider()
+    appData = payloads.app_payload(app, body["metadata"]["name"])
+    idempotency = idempotency_key(body, "install", app.id, app.fingerprint)
+    callbacks.expect(body, "apps", app.id, idempotency)
+    return workqueue.submit(
+        app_lane(body, app), (*model.object_key(body), "install", app.id), workqueue.INSTALL,
+        provider.method("install_app"), appData,
+        batch=provider.method("install_apps"),
+        idempotency=idempotency
+    )
+
+def uninstall_app(body, app):
+    provider = app_provider()
+    appData = payloads.app_uninstall_payload(app)
+    return workqueue.submit(
+        app_lane(body, app), (*model.object_key(body), "uninstall", app.id), workqueue.DELETE,
+        provider.method("uninstall_app"), appData,
+        batch=provider.method("uninstall_apps"),
+        supersedes=[(*model.object_key(body), "install", app.id)],
+        idempotency=idempotency_key(body, "uninstall", app.id, app.fingerprint)
+    )
+
+def cluster_status(cluster):
+    # Coroutine asking the provider whether the cluster is ready
+    return cluster_provider(cluster).cluster_status(cluster.name)
@@ -0,0 +1,97 @@
+# Request bodies sent to the orch-backend, built from the spec entries (see
+# model.py). An entry is serialised once per content: payloads are cached
+# by the entry's fingerprint and shared, so they must not be modified.
+
+import os
+from collections import OrderedDict
+
+# Payloads kept, the least recently used are dropped first
+PAYLOAD_CACHE_SIZE = int(os.environ.get("PAYLOAD_CACHE_SIZE", "10000"))
+
+_MISSING = object()
+
+_cache = OrderedDict()
+
+
+def cached(key, build, entry):
+    payload = _cache.get(key)
+    if payload is not None:
+        _cache.move_to_end(key)
+        return payload
+
+    payload = _cache[key] = build(entry)
+    while len(_cache) > PAYLOAD_CACHE_SIZE:
+        _cache.popitem(last=False)
+    return payload
+
+def with_status(payload, entry):
+    # The status is not part of the fingerprint, so it goes into the cache key
+    status = entry.raw.get("status", _MISSING)
+    if status is not _MISSING:
+        payload["status"] = status
+    return payload
+
+def build_cluster(cluster):
+    clusterData = {
+        "clusterName":  cluster.name,
+        "kubernetesType": "kubeadm",
+        "kubernetesVersion": cluster.kubernetes_version,
+        "controlPlaneCount": cluster.control_plane_count,
+        "controlPlaneFlavor": cluster.control_plane_flavor,
+        "workerMachineCount": cluster.worker_machine_count,
+        "workerMachineFlavor": cluster.worker_machine_flavor,
+        "image": cluster.image,
+        "datacenter": cluster.datacenter
+    }
+    return with_status(clusterData, cluster)
+
+def build_cluster_update(cluster):
+    return {
+        "clusterName":  cluster.name,
+        "kubernetesType": "kubeadm",
+        "kubernetesVersion": cluster.kubernetes_version,
+        "controlPlaneCount": cluster.control_plane_count,
+        "controlPlaneFlavor": cluster.control_plane_flavor,
+        "workerMachineCount": cluster.worker_machine_count,
+        "workerMachineFlavor": cluster.worker_machine_flavor,
+        "image": cluster.image
+    }
+
+def build_app(app, llorch_name):
+    appData = {
+        "name": app.name,
+        "owner": app.owner,
+        "cluster":  app.cluster,
+        # The spec's own list, it is only read
+        "components": app.raw.get("components"),
+        "id": app.id,
+        "crd_name": llorch_name
+    }
+    return with_status(appData, app)
+
+def build_app_uninstall(app):
+    return {
+        "name": app.name,
+        "cluster":  app.cluster,
+        "id": app.id
+    }
+
+def cluster_payload(cluster):
+    key = ("cluster", cluster.fingerprint, cluster.raw.get("status", _MISSING))
+    return cached(key, build_cluster, cluster)
+
+def cluster_update_payload(cluster):
+    return cached(("cluster_update", cluster.fingerprint), build_cluster_update, cluster)
+
+def link_payload(link):
+    return {
+        "greenClusterName":  link.green,
+        "roseClusterName":  link.rose
+    }
+
+def app_payload(app, llorch_name):
+    key = ("app", app.fingerprint, app.raw.get("status", _MISSING), llorch_name)
+    return cached(key, lambda app: build_app(app, llorch_name), app)
+
+def app_uninstall_payload(app):
+    return cached(("app_uninstall", app.fingerprint), build_app_uninstall, app)
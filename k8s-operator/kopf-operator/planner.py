@@ -0,0 +1,196 @@
+import asyncio
+import datetime
+import logging
+
+import callbacks
+import metrics
+import model
+import operations
+import readiness
+import writeback
+from providers import registry
+
+
+class Rejected(Exception):
+    pass
+
+
+class Plan:
+    """Dependency graph of the operations needed to roll out a spec.
+
+    Every node starts as soon as all the nodes it depends on have finished,
+    so the rollout takes as long as its longest chain of dependencies.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        # When the last backend operation of the rollout returned, which is
+        # when it is reconciled; waiting for readiness or callbacks is not
+        self.last_call = None
+
+    def add(self, key, run, deps=(), blocked=None):
+        # blocked(error) is called instead of run() when a dependency failed
+        self.nodes[key] = (run, [dep for dep in deps if dep != key], blocked)
+
+    async def execute(self):
+        tasks = {}
+
+        async def run_node(key):
+            run, deps, blocked = self.nodes[key]
+            try:
+                await asyncio.gather(*(tasks[dep] for dep in deps if dep in tasks))
+            except Exception as e:
+                if blocked is not None:
+                    blocked(e)
+                raise
+            await run()
+
+        for key in self.nodes:
+            tasks[key] = asyncio.ensure_future(run_node(key))
+
+        results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+        failed = [(key, result) for key, result in zip(tasks, results) if isinstance(result, BaseException)]
+        for key, error in failed:
+            logging.warning("Rollout step %s failed: %s", key, error)
+        if failed:
+            raise failed[0][1]
+
+    async def tracked(self, body, kind, key, future):
+        # Report an entry as deploying once the backend accepted it, or as
+        # failed. Error answers are results, not exceptions: they raise here,
+        # so what depends on the entry is blocked at once.
+        try:
+            result = await future
+        except Exception as e:
+            writeback.record(body, kind, key, "error", error=e)
+            raise
+        finally:
+            self.last_call = datetime.datetime.now(datetime.timezone.utc)
+
+        failed = [response for response in registry.responses(result) if not getattr(response, "ok", True)]
+        if failed:
+            error = Rejected(f"orch-backend answered {failed[0].status_code}")
+            writeback.record(body, kind, key, "error", result=failed[0], error=error)
+            raise error
+
+        writeback.record(body, kind, key, "deploying", result=result)
+        return result
+
+
+def app_clusters(body, app, names):
+    refs = [app.cluster]
+    refs += [component.cluster_selector for component in app.components]
+
+    clusters = {model.cluster_name(body, ref, names) for ref in refs}
+    clusters.discard(None)
+    return clusters
+
+def rollout_plan(body, clusters=(), links=(), apps=()):
+    # clusters, links and apps are entries of the parsed spec. Clusters are
+    # deployed first and count as done once the backend reports them ready;
+    # each link waits for both its clusters, and each app for the clusters it
+    # or its components are placed on and the links between those. Links and
+    # apps count as done once the backend calls back, if it does (see
+    # callbacks.py). References to clusters that are not being created here
+    # are taken as already available.
+    plan = Plan()
+    names = {cluster.name for cluster in clusters}
+    # The backend's callbacks say when a cluster is ready, no need to ask
+    poll = not callbacks.enabled()
+
+    for cluster in clusters:
+        async def deploy(cluster=cluster):
+            readiness.reset(body, cluster.name)
+            await plan.tracked(body, "clusters", cluster.name, operations.create_cluster(body, cluster))
+            try:
+                query = (lambda: operations.cluster_status(cluster)) if poll else None
+                await readiness.wait_cluster(body, cluster.name, query)
+            except Exception as e:
+                writeback.record(body, "clusters", cluster.name, "error", error=str(e) or "not ready in time")
+                raise
+            writeback.record(body, "clusters", cluster.name, "ready")
+            logging.info("Lowlevel Orchestration cluster %s ready", cluster.name)
+
+        writeback.record(body, "clusters", cluster.name, "pending")
+        plan.add(("cluster", cluster.name), deploy)
+
+    for link in links:
+        async def peer(link=link):
+            await plan.tracked(body, "links", link.label, operations.link_clusters(body, link))
+            try:
+                await callbacks.completion(body, "links", link.key)
+            except callbacks.OperationFailed as e:
+                writeback.record(body, "links", link.label, "error", error=e)
+                raise
+            # The backend does not list links; drift sends again the ones
+            # whose status did not get here (see drift.drifted)
+            writeback.record(body, "links", link.label, "ready")
+            logging.info("Lowlevel Orchestration link created %s", list(link.key))
+
+        def blocked(error, link=link):
+            writeback.record(body, "links", link.label, "error", error=f"Not linked: {error}")
+
+        writeback.record(body, "links", link.label, "pending")
+        deps = [("cluster", name) for name in link.key if name in names]
+        plan.add(("link", *link.key), peer, deps, blocked)
+
+    link_names = {name for link in links for name in link.key}
+    for app in apps:
+        async def install(app=app):
+            await plan.tracked(body, "apps", app.id, operations.install_app(body, app))
+            logging.info("Lowlevel Orchestration app created %s", app.name)
+            try:
+                done = await callbacks.completion(body, "apps", app.id)
+            except callbacks.OperationFailed as e:
+                writeback.record(body, "apps", app.id, "error", error=e)
+                raise
+            if done:
+                writeback.record(body, "apps", app.id, "ready")
+
+        def blocked(error, app=app):
+            writeback.record(body, "apps", app.id, "error", error=f"Not installed: {error}")
+
+        writeback.record(body, "apps", app.id, "pending")
+        placed = app_clusters(body, app, names | link_names)
+        deps = [("cluster", name) for name in placed if name in names]
+        deps += [("link", *link.key) for link in links if link.green in placed and link.rose in placed]
+        plan.add(("app", app.id), install, deps, blocked)
+
+    return plan
+
+
+# (namespace, name) -> rollouts still running for the object
+_running = {}
+
+
+def start(body, plan, handler, event_time):
+    # Rollouts wait for status writes that kopf only delivers once the
+    # handler has returned, so they run in the background.
+    key = model.object_key(body)
+
+    async def run():
+        try:
+            await plan.execute()
+            if plan.last_call is not None:
+                metrics.reconciled(handler, event_time, plan.last_call)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error("Lowlevel Orchestration %s rollout failed: %s", key[1], e)
+        finally:
+            running = _running.get(key, set())
+            running.discard(task)
+            if not running:
+                _running.pop(key, None)
+
+    task = asyncio.get_running_loop().create_task(run())
+    _running.setdefault(key, set()).add(task)
+    return task
+
+def busy(body):
+    # True while a rollout of the object is running
+    return model.object_key(body) in _running
+
+def cancel(body):
+    for task in _running.pop(model.object_key(body), set()):
+        task.cancel()
@@ -1,16 +1,35 @@
 import logging
-import requests
-
-API_URL = "http://orch-backend.orchestration.charity-project.eu/v1"
+from providers.backend import backend
 
 def install_app(appData):
 
-    response = requests.post(API_URL + "/installapp", json=appData)
+    response = backend.post("/installapp", json=appData)
 
     
-    logging.info(f"Install App request sent...")
+    logging.info("Install App request sent...")
+    return response
 
 def uninstall_app(appData):
-    response = requests.delete(API_URL + "/uninstallapp", params=appData)
+    response = backend.delete("/uninstallapp", params=appData)
+
+    logging.info("Uninstall App request sent...")
+    return response
+
+def install_apps(appDataList):
+    responses = backend.batch("POST", "/installapps", appDataList, install_app)
+
+    logging.info("Install App requests sent for %d apps...", len(appDataList))
+    return responses
+
+def uninstall_apps(appDataList):
+    responses = backend.batch("DELETE", "/uninstallapps", appDataList, uninstall_app)
+
+    logging.info("Uninstall App requests sent for %d apps...", len(appDataList))
+    return responses
+
+def list_apps():
+    # Observed state of every installed app, in one request
+    response = backend.get("/apps")
+    response.raise_for_status()
 
-    logging.info(f"Uninstall App request sent...")
\ No newline at end of file
+    return response.json()
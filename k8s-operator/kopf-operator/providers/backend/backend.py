@@ -0,0 +1,193 @@
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from providers.backend.breaker import BackendUnavailable, CircuitBreaker
+from providers.backend.limiter import AdaptiveLimit
+
+API_URL = os.environ.get("ORCH_BACKEND_URL", "http://orch-backend.orchestration.charity-project.eu/v1")
+
+# Seconds to wait for the TCP connection and for the response respectively
+CONNECT_TIMEOUT = float(os.environ.get("BACKEND_CONNECT_TIMEOUT", "3.05"))
+READ_TIMEOUT = float(os.environ.get("BACKEND_READ_TIMEOUT", "30"))
+
+# Retries after the first attempt, spaced with full-jitter exponential backoff
+MAX_RETRIES = int(os.environ.get("BACKEND_MAX_RETRIES", "3"))
+BACKOFF_BASE = float(os.environ.get("BACKEND_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.environ.get("BACKEND_BACKOFF_MAX", "10"))
+RETRY_STATUSES = {500, 502, 503, 504}
+
+# Keep-alive connections kept open and requests allowed in flight operator-wide.
+# The in-flight limit shrinks when answers fail, or get slower than
+# BACKEND_LATENCY_TOLERANCE times what is usual for their endpoint, and grows
+# back to the maximum as they recover.
+POOL_SIZE = int(os.environ.get("BACKEND_POOL_SIZE", "20"))
+MAX_IN_FLIGHT = int(os.environ.get("BACKEND_MAX_IN_FLIGHT", "20"))
+LATENCY_TOLERANCE = float(os.environ.get("BACKEND_LATENCY_TOLERANCE", "2"))
+
+# Failures in a row that open an endpoint's circuit, and seconds before it is probed again
+BREAKER_FAILURES = int(os.environ.get("BACKEND_BREAKER_FAILURES", "5"))
+BREAKER_RESET = float(os.environ.get("BACKEND_BREAKER_RESET", "30"))
+
+# Items per request sent to the batch endpoints; "off" in BACKEND_BATCHING disables them
+BATCH_SIZE = int(os.environ.get("BACKEND_BATCH_SIZE", "50"))
+BATCHING = os.environ.get("BACKEND_BATCHING", "auto")
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+# Keys of the operations the calls in this context are made for, one per item of a batch
+idempotency_keys = contextvars.ContextVar("idempotency_keys", default=())
+
+CALLBACK_HEADER = "Callback-Url"
+# Where the backend reports the operations it has completed, set while the
+# operator listens for them (see callbacks.py)
+callback_url = None
+
+_session = None
+_session_lock = threading.Lock()
+_in_flight = AdaptiveLimit(MAX_IN_FLIGHT, tolerance=LATENCY_TOLERANCE)
+# operation -> CircuitBreaker
+_breakers = {}
+_breakers_lock = threading.Lock()
+# Batch endpoints the backend answered 404/405 for, not tried again
+_unsupported_batches = set()
+
+
+def get_session():
+    global _session
+
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # Retries are done in request() so they also cover 5xx answers
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=0)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+
+    return _session
+
+def backoff(attempt):
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def operation(path):
+    # Metric label of a call: the endpoint without its path parameters
+    return path.strip("/").split("/")[0]
+
+def breaker(path):
+    name = operation(path)
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, BREAKER_FAILURES, BREAKER_RESET)
+        return _breakers[name]
+
+def settle(circuit, latency, ok):
+    # Feed the outcome of one attempt to the endpoint's circuit and the in-flight limit
+    circuit.record(ok)
+    metrics.backend_breaker_state.labels(circuit.operation).set(circuit.state)
+    metrics.backend_concurrency_limit.set(_in_flight.record(circuit.operation, latency, ok))
+
+def request(method, path, **kwargs):
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    keys = [key for key in idempotency_keys.get() if key]
+    if keys:
+        # Lets the backend recognise an operation it has already been asked
+        # for, and name it in the completion callback
+        headers = {IDEMPOTENCY_HEADER: ",".join(keys)}
+        if callback_url:
+            headers[CALLBACK_HEADER] = callback_url
+        kwargs["headers"] = {**headers, **kwargs.get("headers", {})}
+    url = API_URL + path
+    labels = (operation(path), method)
+    circuit = breaker(path)
+    attempt = 0
+
+    while True:
+        try:
+            circuit.allow()
+        except BackendUnavailable:
+            metrics.backend_rejected.labels(labels[0]).inc()
+            raise
+
+        try:
+            with _in_flight, metrics.backend_in_flight.labels(labels[0]).track_inprogress():
+                start = time.perf_counter()
+                response = None
+                try:
+                    response = get_session().request(method, url, **kwargs)
+                finally:
+                    latency = time.perf_counter() - start
+                    metrics.backend_latency.labels(*labels).observe(latency)
+                    settle(circuit, latency, response is not None and response.status_code not in RETRY_STATUSES)
+        except requests.RequestException as e:
+            metrics.backend_requests.labels(*labels, "error").inc()
+            # Read timeouts are not retried: the backend may already be doing the work
+            if not isinstance(e, requests.ConnectionError) or attempt >= MAX_RETRIES:
+                raise
+            logging.warning("%s %s failed (%s), retrying...", method, path, e)
+        else:
+            metrics.backend_requests.labels(*labels, str(response.status_code)).inc()
+            if response.status_code not in RETRY_STATUSES or attempt >= MAX_RETRIES:
+                if not response.ok:
+                    logging.warning("%s %s answered %d", method, path, response.status_code)
+                return response
+            logging.warning("%s %s answered %d, retrying...", method, path, response.status_code)
+
+        metrics.backend_retries.labels(*labels).inc()
+        time.sleep(backoff(attempt))
+        attempt += 1
+
+def get(path, **kwargs):
+    return request("GET", path, **kwargs)
+
+def post(path, **kwargs):
+    return request("POST", path, **kwargs)
+
+def patch(path, **kwargs):
+    return request("PATCH", path, **kwargs)
+
+def delete(path, **kwargs):
+    return request("DELETE", path, **kwargs)
+
+def batch(method, path, items, single):
+    # Send items to the batch endpoint in chunks of BATCH_SIZE. If the backend
+    # has no such endpoint, send them through single() concurrently instead,
+    # so the calls are still pipelined over the pooled connections.
+    items = list(items)
+    keys = list(idempotency_keys.get())
+    keys = keys if len(keys) == len(items) else [None] * len(items)
+    responses = []
+
+    if BATCHING != "off" and path not in _unsupported_batches:
+        while items:
+            token = idempotency_keys.set(tuple(keys[:BATCH_SIZE]))
+            try:
+                response = request(method, path, json=items[:BATCH_SIZE])
+            finally:
+                idempotency_keys.reset(token)
+            if response.status_code in (404, 405):
+                logging.info("Backend has no %s %s, sending single requests", method, path)
+                _unsupported_batches.add(path)
+                break
+            responses.append(response)
+            items = items[BATCH_SIZE:]
+            keys = keys[BATCH_SIZE:]
+
+    def send(item, key):
+        # Runs in a pool thread, which does not see this context's keys
+        idempotency_keys.set((key,))
+        return single(item)
+
+    if items:
+        with ThreadPoolExecutor(max_workers=min(len(items), MAX_IN_FLIGHT)) as executor:
+            responses.extend(executor.map(send, items, keys))
+
+    return responses
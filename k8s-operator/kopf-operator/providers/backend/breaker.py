@@ -0,0 +1,61 @@
+import threading
+import time
+
+
+class BackendUnavailable(Exception):
+    """Raised instead of sending a request to an endpoint whose circuit is open."""
+
+    def __init__(self, operation, retry_after):
+        super().__init__(f"orch-backend {operation} is unavailable, retrying in {retry_after:.0f}s")
+        self.operation = operation
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Stops calls to an endpoint after consecutive failures.
+
+    After `failures` failures in a row the circuit opens and calls are
+    rejected for `reset` seconds. Then a single probe is let through: its
+    success closes the circuit, its failure opens it again.
+    """
+
+    CLOSED = 0
+    HALF_OPEN = 1
+    OPEN = 2
+
+    def __init__(self, operation, failures, reset):
+        self.operation = operation
+        self.threshold = failures
+        self.reset = reset
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        # Raises BackendUnavailable if the call must not be sent
+        with self.lock:
+            if self.state == self.OPEN:
+                waited = time.monotonic() - self.opened_at
+                if waited < self.reset:
+                    raise BackendUnavailable(self.operation, self.reset - waited)
+                self.state = self.HALF_OPEN
+                self.probing = False
+
+            if self.state == self.HALF_OPEN:
+                if self.probing:
+                    raise BackendUnavailable(self.operation, self.reset)
+                self.probing = True
+
+    def record(self, ok):
+        with self.lock:
+            if ok:
+                self.state = self.CLOSED
+                self.failures = 0
+            else:
+                self.failures += 1
+                if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                    self.state = self.OPEN
+                    self.opened_at = time.monotonic()
+            self.probing = False
@@ -0,0 +1,65 @@
+import threading
+import time
+
+
+class AdaptiveLimit:
+    """Bounds the requests in flight with a limit that follows the backend's health.
+
+    Additive increase, multiplicative decrease. Each endpoint's answers are
+    compared with its own baseline, a slow moving average of its successful
+    latencies, so an endpoint that is always slow does not count as
+    degrading. An answer within `tolerance` times the baseline, or faster
+    than `floor` seconds, raises the limit by 1/limit, so by about one per
+    round of requests, up to `maximum`. An error or a slower answer
+    multiplies it by `decrease`, at most once per `interval` seconds so a
+    burst of failures counts once, down to `minimum`.
+    """
+
+    def __init__(self, maximum, minimum=1, tolerance=2.0, decrease=0.5, interval=2.0, floor=0.1, smoothing=0.05):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.tolerance = tolerance
+        self.decrease = decrease
+        self.interval = interval
+        self.floor = floor
+        self.smoothing = smoothing
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self.decreased_at = 0.0
+        # operation -> moving average of its successful latencies
+        self.baselines = {}
+        self.condition = threading.Condition()
+
+    def __enter__(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    def slow(self, operation, latency):
+        baseline = self.baselines.get(operation)
+        return baseline is not None and latency > self.floor and latency > baseline * self.tolerance
+
+    def record(self, operation, latency, ok):
+        with self.condition:
+            now = time.monotonic()
+            slow = self.slow(operation, latency)
+            if ok:
+                # Slow answers move the baseline as well, a lasting change
+                # becomes the endpoint's new normal
+                baseline = self.baselines.get(operation, latency)
+                self.baselines[operation] = baseline + self.smoothing * (latency - baseline)
+
+            if ok and not slow:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            elif now - self.decreased_at >= self.interval:
+                self.limit = max(self.minimum, self.limit * self.decrease)
+                self.decreased_at = now
+            self.condition.notify_all()
+            return self.limit
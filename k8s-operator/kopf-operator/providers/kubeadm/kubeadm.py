@@ -1,25 +1,33 @@
 import logging
-import requests
-
-API_URL = "http://orch-backend.orchestration.charity-project.eu/v1"
+from providers.backend import backend
 
 def create_cluster(clusterData):
 
     clusterName = clusterData["clusterName"]
     # logging.info(clusterData)
-    response = requests.post(API_URL + "/deploycluster", json=clusterData)
+    response = backend.post("/deploycluster", json=clusterData)
 
-    logging.info(f"Cluster {clusterName} is being created...")
+    logging.info("Cluster %s is being created...", clusterName)
+    return response
 
 def delete_cluster(clusterName, datacenter):
 
-    response = requests.delete(API_URL + "/deletecluster/" + clusterName + "/" + datacenter, json=clusterName)
+    response = backend.delete("/deletecluster/" + clusterName + "/" + datacenter, json=clusterName)
 
-    logging.info(f"Cluster {clusterName} is being deleted...")
+    logging.info("Cluster %s is being deleted...", clusterName)
+    return response
 
 def update_cluster(clusterData):
     clusterName = clusterData["clusterName"]
 
-    response = requests.patch(API_URL + "/cluster/" + clusterName, json=clusterData)
+    response = backend.patch("/cluster/" + clusterName, json=clusterData)
+
+    logging.info("Cluster %s is being updated...", clusterName)
+    return response
+
+def list_clusters():
+    # Observed state of every cluster the backend manages, in one request
+    response = backend.get("/clusters")
+    response.raise_for_status()
 
-    logging.info(f"Cluster {clusterName} is being updated...")
+    return response.json()
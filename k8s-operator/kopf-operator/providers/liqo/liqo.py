@@ -1,13 +1,24 @@
 import logging
-import requests
-
-API_URL = "http://orch-backend.orchestration.charity-project.eu/v1"
+from providers.backend import backend
 
 def link_clusters(linkData):
     
-    logging.info(API_URL + f"/peer?greenClusterName={linkData['greenClusterName']}&roseClusterName={linkData['roseClusterName']}")
-    response = requests.get(API_URL + f"/peer?greenClusterName={linkData['greenClusterName']}&roseClusterName={linkData['roseClusterName']}")
+    params = {
+        "greenClusterName": linkData['greenClusterName'],
+        "roseClusterName": linkData['roseClusterName']
+    }
+    response = backend.get("/peer", params=params)
+
+    logging.info("Link request sent for %s and %s...", params['greenClusterName'], params['roseClusterName'])
+    return response
+
+def unlink_clusters(linkData):
 
-    logging.info(f"Link request sent...")
+    params = {
+        "greenClusterName": linkData['greenClusterName'],
+        "roseClusterName": linkData['roseClusterName']
+    }
+    response = backend.get("/unpeer", params=params)
 
-# def unlink_clusters(linkData):
\ No newline at end of file
+    logging.info("Unlink request sent for %s and %s...", params['greenClusterName'], params['roseClusterName'])
+    return response
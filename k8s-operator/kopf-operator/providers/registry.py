@@ -0,0 +1,123 @@
+# Providers the operator deploys clusters, links and apps with, looked up by
+# kind ("clusters", "links", "apps") and name, e.g. a cluster's kubernetes-type.
+#
+# A provider is a module. Cluster providers define create_cluster(clusterData),
+# update_cluster(clusterData), delete_cluster(clusterName, datacenter) and
+# list_clusters(); link providers define link_clusters(linkData) and
+# unlink_clusters(linkData); app providers define install_app(appData),
+# uninstall_app(appData) and list_apps(). App providers may also define the
+# batch variants (install_apps, uninstall_apps) taking a list, and cluster
+# providers cluster_status(clusterName) for readiness. Each cluster's
+# operations run in order on a work queue lane of their own, so cluster
+# deploys are not batched.
+# Functions may be plain or async.
+#
+# Besides the built-in ones, providers are found through the entry point groups
+# llo_operator.clusters, llo_operator.links and llo_operator.apps. Nothing is
+# imported until a provider is first used.
+
+import asyncio
+import contextvars
+import functools
+import importlib
+import importlib.metadata
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Threads each provider's plain functions run on, so a slow provider cannot
+# take the threads of the others
+PROVIDER_THREADS = int(os.environ.get("PROVIDER_THREADS", "10"))
+
+ENTRY_POINT_GROUP = "llo_operator.{kind}"
+
+BUILTIN = {
+    "clusters": {"kubeadm": "providers.kubeadm.kubeadm"},
+    "links": {"liqo": "providers.liqo.liqo"},
+    "apps": {"apps": "providers.apps.apps"},
+}
+
+# kind -> name -> module path or entry point, not imported yet
+_available = None
+# (kind, name) -> Provider
+_loaded = {}
+
+
+class Provider:
+    """A provider module behind async methods, whether its functions are async or not."""
+
+    def __init__(self, kind, name, module):
+        self.kind = kind
+        self.name = name
+        self.module = module
+        self.executor = ThreadPoolExecutor(max_workers=PROVIDER_THREADS, thread_name_prefix=f"{kind}-{name}")
+        self.methods = {}
+
+    def method(self, name):
+        # Async callable for the module's function, the same object on every
+        # call so the work queue can tell operations of one batch apart; None
+        # if the provider does not have it
+        if name not in self.methods:
+            func = getattr(self.module, name, None)
+            self.methods[name] = None if func is None else self.wrap(func)
+        return self.methods[name]
+
+    def wrap(self, func):
+        if asyncio.iscoroutinefunction(func):
+            return func
+
+        @functools.wraps(func)
+        async def call(*args):
+            # Run with the caller's context, which carries the idempotency keys
+            context = contextvars.copy_context()
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, functools.partial(context.run, func, *args)
+            )
+        return call
+
+    async def cluster_status(self, clusterName):
+        # Readiness of one cluster as the backend sees it
+        status = self.method("cluster_status")
+        if status is not None:
+            return await status(clusterName)
+
+        for cluster in await self.method("list_clusters")():
+            if cluster.get("clusterName") == clusterName:
+                return cluster.get("status")
+        return None
+
+
+def responses(result):
+    # Provider functions return a response, or a list of them for the batch variants
+    return result if isinstance(result, list) else [result]
+
+def entry_points(group):
+    found = importlib.metadata.entry_points()
+    if hasattr(found, "select"):
+        return found.select(group=group)
+    return found.get(group, [])
+
+def available():
+    global _available
+
+    if _available is None:
+        _available = {kind: dict(providers) for kind, providers in BUILTIN.items()}
+        for kind in _available:
+            for entry_point in entry_points(ENTRY_POINT_GROUP.format(kind=kind)):
+                _available[kind][entry_point.name] = entry_point
+    return _available
+
+def names(kind):
+    return sorted(available()[kind])
+
+def get(kind, name):
+    key = (kind, name)
+    if key not in _loaded:
+        source = available()[kind].get(name)
+        if source is None:
+            raise KeyError(f"No {kind} provider named {name!r}")
+
+        module = importlib.import_module(source) if isinstance(source, str) else source.load()
+        logging.info("Loaded the %s provider %s", kind, name)
+        _loaded[key] = Provider(kind, name, module)
+    return _loaded[key]
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import os
+
+import model
+
+# Values the backend writes in spec.clusters[].status once a cluster is usable or has failed
+READY_STATUSES = frozenset(os.environ.get("CLUSTER_READY_STATUSES", "ready,running").split(","))
+ERROR_STATUSES = frozenset(os.environ.get("CLUSTER_ERROR_STATUSES", "error").split(","))
+# Longest wait for a cluster before the work that depends on it is given up
+READY_TIMEOUT = float(os.environ.get("CLUSTER_READY_TIMEOUT", "3600"))
+# Seconds between two readiness queries to the provider while waiting, in case
+# the status write to the LowLevelOrchestration is missed; 0 disables them
+READY_POLL_INTERVAL = float(os.environ.get("CLUSTER_READY_POLL_INTERVAL", "60"))
+
+# (namespace, llorch name, cluster name) -> last status seen
+_statuses = {}
+# (namespace, llorch name, cluster name) -> futures waiting for the cluster
+_waiters = {}
+# (namespace, llorch name, cluster name) -> status in the spec when the
+# cluster was (re)deployed, which says nothing about the new deployment
+_stale = {}
+
+
+class ClusterFailed(Exception):
+    pass
+
+
+def cluster_key(body, name):
+    return (*model.object_key(body), name)
+
+def set_status(key, status):
+    _statuses[key] = status
+    _stale.pop(key, None)
+
+    if status in READY_STATUSES or status in ERROR_STATUSES:
+        for future in _waiters.pop(key, []):
+            if future.done():
+                continue
+            if status in READY_STATUSES:
+                future.set_result(status)
+            else:
+                future.set_exception(ClusterFailed(f"Cluster {key[2]} is in status {status}"))
+
+def observe(body):
+    # Called for every watch event of the object, so waiters wake up as soon
+    # as the backend writes the cluster status
+    for cluster in model.parse(body).clusters.values():
+        key = cluster_key(body, cluster.name)
+        status = cluster.status
+        if key in _stale and _stale[key] == status:
+            continue
+        if _statuses.get(key) != status:
+            set_status(key, status)
+
+def reset(body, name):
+    # A cluster being (re)deployed is not ready whatever was seen before, and
+    # the spec keeps its old status until the backend writes a new one. The
+    # provider's answers to the readiness queries and the callbacks are new.
+    key = cluster_key(body, name)
+    if key not in _stale:
+        _stale[key] = _statuses.get(key)
+    _statuses[key] = None
+
+def forget(body):
+    object_key = model.object_key(body)
+    for key in [key for key in _statuses if key[:2] == object_key]:
+        del _statuses[key]
+        _stale.pop(key, None)
+    for key in [key for key in _waiters if key[:2] == object_key]:
+        for future in _waiters.pop(key):
+            future.cancel()
+
+async def poll(key, future, query):
+    while not future.done():
+        await asyncio.sleep(READY_POLL_INTERVAL)
+        try:
+            status = await query()
+        except Exception as e:
+            logging.warning("Could not query the status of cluster %s: %s", key[2], e)
+            continue
+        if status is not None and _statuses.get(key) != status:
+            set_status(key, status)
+
+async def wait_cluster(body, name, query=None):
+    # query, if given, is an async function returning the cluster status as
+    # the provider sees it
+    key = cluster_key(body, name)
+    status = _statuses.get(key)
+    if status in READY_STATUSES:
+        return status
+    if status in ERROR_STATUSES:
+        raise ClusterFailed(f"Cluster {name} is in status {status}")
+
+    future = asyncio.get_running_loop().create_future()
+    _waiters.setdefault(key, []).append(future)
+    if query is None or READY_POLL_INTERVAL <= 0:
+        return await asyncio.wait_for(future, READY_TIMEOUT)
+
+    poller = asyncio.get_running_loop().create_task(poll(key, future, query))
+    try:
+        return await asyncio.wait_for(future, READY_TIMEOUT)
+    finally:
+        poller.cancel()
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import os
+from collections import namedtuple
+
+import operations
+
+# Clusters of one LowLevelOrchestration patched at the same time
+SCALE_PARALLELISM = int(os.environ.get("SCALE_PARALLELISM", "5"))
+# Where the outcome of the last scale changes is reported in the object
+STATUS_FIELD = "scaling"
+
+ScaleChange = namedtuple("ScaleChange", ["name", "control_plane_delta", "worker_delta", "cluster"])
+
+
+def scalable(cluster):
+    # External clusters are managed elsewhere, the operator never scales them
+    return cluster.provider != "external"
+
+def scale_changes(updates):
+    # updates are the (old, new) pairs of clusters matched by name; a count
+    # left out of the spec counts as none
+    changes = []
+    for old_cluster, new_cluster in updates:
+        control_plane_delta = (new_cluster.control_plane_count or 0) - (old_cluster.control_plane_count or 0)
+        worker_delta = (new_cluster.worker_machine_count or 0) - (old_cluster.worker_machine_count or 0)
+        if not control_plane_delta and not worker_delta:
+            continue
+
+        if not scalable(new_cluster):
+            logging.info("Cluster %s is external, not scaling it", new_cluster.name)
+            continue
+
+        changes.append(ScaleChange(new_cluster.name, control_plane_delta, worker_delta, new_cluster))
+
+    return changes
+
+async def apply(body, changes, patch):
+    # Patch at most SCALE_PARALLELISM clusters at a time and record every
+    # outcome in status.scaling. The first failure is raised once all the
+    # patches are done, so kopf retries the update.
+    semaphore = asyncio.Semaphore(SCALE_PARALLELISM)
+    progress = {}
+
+    async def scale(change):
+        progress[change.name] = {
+            "controlPlaneDelta": change.control_plane_delta,
+            "workerDelta": change.worker_delta,
+            "controlPlaneCount": change.cluster.control_plane_count,
+            "workerMachineCount": change.cluster.worker_machine_count,
+        }
+        async with semaphore:
+            logging.info("Scaling cluster %s: control plane %+d, workers %+d", change.name, change.control_plane_delta, change.worker_delta)
+            try:
+                response = await operations.scale_cluster(body, change.cluster)
+                # Error answers come back as responses; None if a removal of
+                # the cluster superseded the patch
+                if response is not None:
+                    response.raise_for_status()
+            except Exception as e:
+                progress[change.name].update(state="error", error=str(e))
+                raise
+            progress[change.name]["state"] = "requested"
+
+    results = await asyncio.gather(*(scale(change) for change in changes), return_exceptions=True)
+
+    if progress:
+        patch.status[STATUS_FIELD] = progress
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
@@ -0,0 +1,353 @@
+import asyncio
+import bisect
+import datetime
+import hashlib
+import logging
+import os
+import socket
+import time
+
+import kubernetes
+
+import kubeclient
+import model
+
+# "on" to split the LowLevelOrchestrations between the replicas of the Deployment
+SHARDING = os.environ.get("OPERATOR_SHARDING", "off")
+# This replica's identity, the pod name when running in the cluster
+SHARD = os.environ.get("POD_NAME") or socket.gethostname()
+# Where the replicas keep their Leases
+LEASE_NAMESPACE = os.environ.get("POD_NAMESPACE", "orchestration")
+LEASE_DURATION = int(os.environ.get("SHARD_LEASE_DURATION", "30"))
+LEASE_RENEW = float(os.environ.get("SHARD_LEASE_RENEW", "10"))
+# Points per replica on the hash ring, more spread the objects more evenly
+VIRTUAL_NODES = int(os.environ.get("SHARD_VIRTUAL_NODES", "64"))
+# Renewal periods the same set of replicas has to be seen for before the
+# ring changes. Replicas renew out of step, so after a single period some
+# may not have seen the change yet.
+SETTLE_PERIODS = 2
+# Objects per request when listing the fleet to take objects on
+LIST_PAGE_SIZE = int(os.environ.get("SHARD_LIST_PAGE_SIZE", "500"))
+# Longest startup waits for the first ring before kopf starts watching
+STARTUP_TIMEOUT = float(os.environ.get("SHARD_STARTUP_TIMEOUT", str((SETTLE_PERIODS + 1) * LEASE_RENEW)))
+
+LEASE_LABEL = "charity-project.eu/llo-operator-shard"
+OWNER_ANNOTATION = "charity-project.eu/llo-operator-owner"
+# Changed on the objects a replica already had when it got its ring after
+# kopf listed them, so they are seen again
+HANDOVER_ANNOTATION = "charity-project.eu/llo-operator-handover"
+# Each replica blocks deletion with its own finalizer. kopf removes its
+# finalizer from objects its handlers do not match, so with a shared one any
+# replica could release an object before its owner has torn it down.
+FINALIZER_PREFIX = "charity-project.eu/llo-operator-"
+FINALIZER = FINALIZER_PREFIX + SHARD
+# kopf's own finalizer, left on the objects handled before sharding was on
+KOPF_FINALIZER = "kopf.zalando.org/KopfFinalizerMarker"
+
+_coordination = None
+_objects = None
+# Ring the ownership is decided on, and a newer one seen but not taken on yet
+_ring = None
+_candidate = None
+_candidate_since = 0.0
+# Set when the objects of a new ring still have to be taken on
+_handover = False
+# Set when kopf started watching before the first ring settled
+_late = False
+# time.monotonic() of the last successful renewal of this replica's Lease
+_renewed_at = None
+# (namespace, name) of the objects this replica has handled since it took them on
+_adopted = set()
+_task = None
+
+
+class Ring:
+    # Consistent hash ring, so a replica joining or leaving only moves the
+    # objects between it and its neighbours
+
+    def __init__(self, members):
+        self.members = frozenset(members)
+        points = sorted(
+            (point(f"{member}#{index}"), member) for member in self.members for index in range(VIRTUAL_NODES)
+        )
+        self.hashes = [hash_ for hash_, _ in points]
+        self.owners = [member for _, member in points]
+
+    def owner(self, key):
+        if not self.owners:
+            return None
+        index = bisect.bisect(self.hashes, point(key)) % len(self.hashes)
+        return self.owners[index]
+
+
+def point(key):
+    return int(hashlib.sha1(key.encode()).hexdigest()[:16], 16)
+
+def enabled():
+    return SHARDING == "on"
+
+def ring_key(namespace, name):
+    return f"{namespace}/{name}"
+
+def lease_name():
+    return f"llo-operator-{SHARD}"
+
+def get_coordination():
+    global _coordination
+
+    if _coordination is None:
+        _coordination = kubernetes.client.CoordinationV1Api(kubeclient.get_client())
+    return _coordination
+
+def get_objects():
+    global _objects
+
+    if _objects is None:
+        _objects = kubernetes.client.CustomObjectsApi(kubeclient.get_client())
+    return _objects
+
+def lease_alive():
+    # A replica that could not renew its Lease in time may already have been
+    # replaced by the others, so it stops handling anything
+    return _renewed_at is not None and time.monotonic() - _renewed_at < LEASE_DURATION
+
+def owns_key(namespace, name):
+    if not enabled():
+        return True
+    if not lease_alive() or _ring is None:
+        return False
+
+    key = ring_key(namespace, name)
+    if _ring.owner(key) != SHARD:
+        return False
+    # Objects moving to another replica are given up as soon as the new ring
+    # is seen, but only taken on once it has settled (see refresh), so two
+    # replicas never handle the same object at once
+    return _candidate is None or _candidate.owner(key) == SHARD
+
+def deleting_here(body):
+    # Deletion started while this replica had the object: no other replica
+    # can add its finalizer any more (see takeover_patch), so this one
+    # finishes the teardown whatever the ring or the Lease say meanwhile
+    metadata = body["metadata"]
+    return bool(metadata.get("deletionTimestamp")) and FINALIZER in (metadata.get("finalizers") or [])
+
+def owns(body, **_):
+    # kopf's when= filter for the handlers
+    if enabled() and deleting_here(body):
+        return True
+    return owns_key(*model.object_key(body))
+
+def holds(body, **_):
+    # kopf's when= filter for the delete handler. kopf removes the finalizer
+    # of objects no delete handler matches, so an object keeps matching for
+    # as long as it carries this replica's finalizer: a lapsed Lease or a ring
+    # still settling does not let it be deleted without its teardown. The
+    # replica taking it over swaps the finalizer for its own.
+    if enabled() and FINALIZER in (body["metadata"].get("finalizers") or []):
+        return True
+    return owns(body)
+
+def adopt(body):
+    # True the first time an object is seen after this replica took it on
+    key = model.object_key(body)
+    if key in _adopted:
+        return False
+    _adopted.add(key)
+    return True
+
+def release(body):
+    # True if an object this replica handled has moved to another one
+    key = model.object_key(body)
+    if key not in _adopted:
+        return False
+    _adopted.discard(key)
+    return True
+
+def lease_body(now):
+    return {
+        "metadata": {"name": lease_name(), "labels": {LEASE_LABEL: "true"}},
+        "spec": {
+            "holderIdentity": SHARD,
+            "leaseDurationSeconds": LEASE_DURATION,
+            "renewTime": timestamp(now),
+        },
+    }
+
+def timestamp(now):
+    # Leases hold MicroTime, which needs the microseconds written out
+    return now.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+def renew():
+    # Create or renew this replica's Lease
+    global _renewed_at
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    api = get_coordination()
+    try:
+        api.patch_namespaced_lease(lease_name(), LEASE_NAMESPACE, {"spec": {"renewTime": timestamp(now), "holderIdentity": SHARD}})
+    except kubernetes.client.ApiException as e:
+        if e.status != 404:
+            raise
+        api.create_namespaced_lease(LEASE_NAMESPACE, lease_body(now))
+    _renewed_at = time.monotonic()
+
+def members():
+    # Replicas whose Lease has not expired
+    now = datetime.datetime.now(datetime.timezone.utc)
+    leases = get_coordination().list_namespaced_lease(LEASE_NAMESPACE, label_selector=LEASE_LABEL)
+
+    alive = set()
+    for lease in leases.items:
+        spec = lease.spec
+        if spec.holder_identity is None or spec.renew_time is None:
+            continue
+        expires = spec.renew_time + datetime.timedelta(seconds=spec.lease_duration_seconds or LEASE_DURATION)
+        if expires > now:
+            alive.add(spec.holder_identity)
+    return alive
+
+def refresh(alive):
+    # Move to a new ring once the same set of replicas has been seen for
+    # SETTLE_PERIODS renewal periods, by then every replica has seen it as well
+    global _ring, _candidate, _candidate_since, _handover
+
+    now = time.monotonic()
+    if _ring is not None and alive == _ring.members:
+        _candidate = None
+        return
+
+    if _candidate is None or alive != _candidate.members:
+        _candidate = Ring(alive)
+        _candidate_since = now
+        logging.info("Operator replicas changed to %s, rebalancing", sorted(alive))
+        return
+
+    if now - _candidate_since >= SETTLE_PERIODS * LEASE_RENEW:
+        _ring, _candidate, _handover = _candidate, None, True
+
+def takeover_patch(obj, stamp=None):
+    # Annotate the object and swap the finalizers of the replicas that had it
+    # for this one's. Returns None when there is nothing to change, unless a
+    # handover stamp is given.
+    metadata = obj["metadata"]
+    finalizers = metadata.get("finalizers") or []
+    kept = [
+        finalizer for finalizer in finalizers
+        if not finalizer.startswith(FINALIZER_PREFIX) and finalizer != KOPF_FINALIZER
+    ]
+    if metadata.get("deletionTimestamp"):
+        # No finalizer can be added to an object being deleted; the replica
+        # that started the deletion finishes it when it comes back
+        wanted = finalizers
+    else:
+        wanted = kept + [FINALIZER] if len(kept) != len(finalizers) else finalizers
+
+    owned = (metadata.get("annotations") or {}).get(OWNER_ANNOTATION) == SHARD
+    if owned and wanted == finalizers and stamp is None:
+        return None
+    annotations = {OWNER_ANNOTATION: SHARD}
+    if stamp is not None:
+        annotations[HANDOVER_ANNOTATION] = stamp
+    return {
+        "metadata": {
+            "annotations": annotations,
+            "finalizers": wanted,
+            "resourceVersion": metadata["resourceVersion"],
+        }
+    }
+
+def touch():
+    # Patch the objects this replica has taken on. The event lets kopf
+    # evaluate the when= filters again, which starts their handlers and timers
+    # here and stops them on the replica that had them before. Returns False
+    # if some object has to be tried again.
+    global _late
+
+    api = get_objects()
+    # kopf listed the objects while this replica had none: those it already
+    # had are patched as well, or their handlers would wait for their next change
+    stamp = timestamp(datetime.datetime.now(datetime.timezone.utc)) if _late else None
+    done = True
+    for obj in listed(api):
+        metadata = obj["metadata"]
+        namespace, name = metadata.get("namespace"), metadata["name"]
+        if not owns_key(namespace, name):
+            continue
+        patch = takeover_patch(obj, stamp)
+        if patch is None:
+            continue
+        try:
+            api.patch_namespaced_custom_object(
+                "charity-project.eu", "v1", namespace, "lowlevelorchestrations", name, patch
+            )
+        except kubernetes.client.ApiException as e:
+            if e.status != 404:
+                logging.warning("Could not take on %s/%s: %s", namespace, name, e.reason)
+                done = False
+    if done:
+        _late = False
+    return done
+
+def listed(api):
+    # Every LowLevelOrchestration, LIST_PAGE_SIZE at a time
+    token = None
+    while True:
+        kwargs = {"limit": LIST_PAGE_SIZE}
+        if token:
+            kwargs["_continue"] = token
+        page = api.list_cluster_custom_object("charity-project.eu", "v1", "lowlevelorchestrations", **kwargs)
+        yield from page.get("items", [])
+        token = (page.get("metadata") or {}).get("continue")
+        if not token:
+            return
+
+def heartbeat():
+    global _handover
+
+    renew()
+    refresh(members())
+    if _handover and _candidate is None:
+        _handover = not touch()
+
+async def run():
+    while True:
+        try:
+            await asyncio.to_thread(heartbeat)
+        except Exception as e:
+            logging.warning("Could not renew the operator lease %s: %s", lease_name(), e)
+        await asyncio.sleep(LEASE_RENEW)
+
+async def settled():
+    while _ring is None or not lease_alive():
+        await asyncio.sleep(1)
+
+async def start():
+    # Called before kopf starts watching, so the objects listed first are
+    # already split between the replicas. Waits STARTUP_TIMEOUT at most:
+    # until there is a ring this replica handles nothing, and once there is
+    # one it takes its objects on (see touch).
+    global _task, _late
+
+    if _task is None or _task.done():
+        _task = asyncio.get_running_loop().create_task(run())
+    try:
+        await asyncio.wait_for(settled(), STARTUP_TIMEOUT)
+    except asyncio.TimeoutError:
+        logging.warning("No operator ring after %.0fs, starting without one", STARTUP_TIMEOUT)
+        _late = True
+        return
+    logging.info("Operator replica %s handles its share of %d replicas", SHARD, len(_ring.members))
+
+async def stop():
+    # Hand the objects over straight away instead of waiting for the Lease to expire
+    global _renewed_at
+
+    if _task is None:
+        return
+    _task.cancel()
+    _renewed_at = None
+    try:
+        await asyncio.to_thread(get_coordination().delete_namespaced_lease, lease_name(), LEASE_NAMESPACE)
+    except Exception as e:
+        logging.warning("Could not delete the operator lease %s: %s", lease_name(), e)
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import os
+
+import kopf
+
+import model
+import operations
+import writeback
+from providers import registry
+
+# Longest a teardown stage waits for the backend before the handler is retried
+TEARDOWN_TIMEOUT = float(os.environ.get("TEARDOWN_TIMEOUT", "600"))
+# Seconds between two checks that deleted clusters are gone from the backend
+TEARDOWN_POLL_INTERVAL = float(os.environ.get("TEARDOWN_POLL_INTERVAL", "5"))
+# Seconds before an incomplete teardown is tried again
+TEARDOWN_RETRY_DELAY = float(os.environ.get("TEARDOWN_RETRY_DELAY", "30"))
+
+
+def confirmed(result):
+    # Something the backend no longer knows is as good as removed
+    return all(getattr(response, "ok", True) or getattr(response, "status_code", None) == 404
+               for response in registry.responses(result))
+
+async def remove(kind, futures):
+    # Wait for one stage's removals, which all run at once. Raises a
+    # TemporaryError naming what the backend did not confirm, so kopf keeps
+    # the finalizer and retries; the work queue does not send again what
+    # already went through.
+    if not futures:
+        return
+
+    done, _ = await asyncio.wait(futures.values(), timeout=TEARDOWN_TIMEOUT)
+    failed = []
+    for label, future in futures.items():
+        if future not in done or future.cancelled():
+            failed.append(label)
+        elif future.exception() is not None:
+            logging.warning("Could not remove %s %s: %s", kind, label, future.exception())
+            failed.append(label)
+        elif not confirmed(future.result()):
+            failed.append(label)
+
+    if failed:
+        raise kopf.TemporaryError(f"Could not remove {kind} {', '.join(failed)} yet", delay=TEARDOWN_RETRY_DELAY)
+
+async def gone(clusters):
+    # The backend deletes clusters in the background; wait until it no longer lists them
+    remaining = {cluster.name: cluster for cluster in clusters}
+    deadline = asyncio.get_running_loop().time() + TEARDOWN_TIMEOUT
+
+    while True:
+        listed = set()
+        for provider in {operations.cluster_provider(cluster) for cluster in remaining.values()}:
+            list_clusters = provider.method("list_clusters")
+            if list_clusters is not None:
+                listed.update(cluster["clusterName"] for cluster in await list_clusters())
+
+        remaining = {name: cluster for name, cluster in remaining.items() if name in listed}
+        if not remaining:
+            return
+        if asyncio.get_running_loop().time() >= deadline:
+            raise kopf.TemporaryError(f"Clusters {', '.join(remaining)} are still being deleted",
+                                      delay=TEARDOWN_RETRY_DELAY)
+        await asyncio.sleep(TEARDOWN_POLL_INTERVAL)
+
+async def teardown(body):
+    # Remove everything the final spec describes: the apps, then the links
+    # between the clusters, then the clusters themselves. The spec is not
+    # validated: one that became invalid after it was deployed still has
+    # to be torn down, and kopf would drop the finalizer on InvalidSpec.
+    spec = model.parse(body, strict=False)
+    apps = list(spec.apps.values())
+    links = list(spec.links.values())
+
+    clusters = []
+    for cluster in spec.clusters.values():
+        if cluster.status == "error":
+            logging.info("Skipping deletion of cluster %s in status error", cluster.name)
+        else:
+            clusters.append(cluster)
+
+    for app in apps:
+        writeback.record(body, "apps", app.id, "deleting")
+    await remove("apps", {app.id: operations.uninstall_app(body, app) for app in apps})
+    for app in apps:
+        logging.info("Lowlevel Orchestration app deleted %s", app.name)
+
+    await remove("links", {link.label: operations.unlink_clusters(body, link) for link in links})
+
+    for cluster in clusters:
+        writeback.record(body, "clusters", cluster.name, "deleting")
+    await remove("clusters", {cluster.name: operations.delete_cluster(body, cluster) for cluster in clusters})
+    await gone(clusters)
+    for cluster in clusters:
+        logging.info("Lowlevel Orchestration delete %s %s", cluster.kubernetes_type, cluster.name)
@@ -0,0 +1,311 @@
+import asyncio
+import functools
+import heapq
+import itertools
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+
+import config
+import logs
+from providers import registry
+from providers.backend import backend
+
+# Lower runs first: removals and scale changes go ahead of new work
+DELETE = 0
+SCALE = 1
+CREATE = 2
+INSTALL = 3
+
+# Completed operations remembered so a repeat with the same idempotency key is
+# not sent again. Kept shorter than DRIFT_GRACE, so drift reconciliation can
+# still re-send work the backend lost.
+COMPLETED_SIZE = int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", "10000"))
+COMPLETED_TTL = float(os.environ.get("IDEMPOTENCY_TTL", "600"))
+# Times an operation is put back while its backend endpoint's circuit is open,
+# before it fails with BackendUnavailable
+DEFER_LIMIT = int(os.environ.get("BACKEND_DEFER_LIMIT", "20"))
+
+
+class Operation:
+    __slots__ = ("lane", "key", "priority", "seq", "func", "args", "batch", "idempotency", "future", "superseded",
+                 "deferrals")
+
+    def __init__(self, lane, key, priority, seq, func, args, batch, idempotency, future):
+        self.lane = lane
+        self.key = key
+        self.priority = priority
+        self.seq = seq
+        self.func = func
+        self.args = args
+        self.batch = batch
+        self.idempotency = idempotency
+        self.future = future
+        self.superseded = False
+        self.deferrals = 0
+
+
+class PriorityLimiter:
+    """Semaphore that wakes its waiters in priority order."""
+
+    def __init__(self, limit):
+        self.free = limit
+        self.waiters = []
+        self.seq = itertools.count()
+
+    async def acquire(self, priority):
+        if self.free > 0 and not self.waiters:
+            self.free -= 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.seq), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The slot may have been handed over just before the cancellation
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.free += 1
+
+
+class WorkQueue:
+    """Backend operations of every LowLevelOrchestration, one lane per target cluster.
+
+    Operations in a lane run one at a time and in order, lanes run in parallel
+    up to the global limit, and the lane whose next operation is the most
+    urgent gets the next free slot. An operation submitted again with the same
+    idempotency key joins the queued or running one, or gets the result of the
+    one that recently completed, instead of being sent again.
+    """
+
+    def __init__(self, limit, completed_size=COMPLETED_SIZE, completed_ttl=COMPLETED_TTL):
+        self.limiter = PriorityLimiter(limit)
+        self.lanes = {}
+        self.pending = {}
+        self.running = {}
+        # (namespace, name, entry...) -> (key, idempotency key, result, time.monotonic())
+        self.completed = OrderedDict()
+        self.completed_size = completed_size
+        self.completed_ttl = completed_ttl
+        self.seq = itertools.count()
+
+    @staticmethod
+    def entry(key):
+        # Keys are (namespace, name, action, entry...), results are kept per entry
+        return (key[0], key[1], *key[3:])
+
+    def repeat(self, key, idempotency):
+        # Future of the same operation queued, running or recently done, if any
+        for op in (self.pending.get(key), self.running.get(key)):
+            if op is not None and op.idempotency == idempotency:
+                logging.info("Operation %s already in progress, joined", key)
+                return op.future
+
+        entry = self.entry(key)
+        done = self.completed.get(entry)
+        if done is None:
+            return None
+        done_key, done_idempotency, result, done_at = done
+        if done_key != key:
+            # Another action on the entry since, e.g. a delete after a deploy
+            del self.completed[entry]
+            return None
+        if done_idempotency != idempotency or time.monotonic() - done_at > self.completed_ttl:
+            return None
+
+        self.completed.move_to_end(entry)
+        logging.info("Operation %s already done, not sent again", key)
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(result)
+        return future
+
+    def remember(self, op, result):
+        entry = self.entry(op.key)
+        self.completed[entry] = (op.key, op.idempotency, result, time.monotonic())
+        self.completed.move_to_end(entry)
+        while len(self.completed) > self.completed_size:
+            self.completed.popitem(last=False)
+
+    def submit(self, lane, key, priority, func, *args, batch=None, supersedes=(), idempotency=None):
+        # An operation queued under the same key is replaced by this one and
+        # its waiters get this one's result. Keys in supersedes are dropped.
+        if idempotency is not None:
+            future = self.repeat(key, idempotency)
+            if future is not None:
+                return future
+        self.completed.pop(self.entry(key), None)
+
+        loop = asyncio.get_running_loop()
+        previous = self.pending.pop(key, None)
+        if previous is not None:
+            previous.superseded = True
+            future = previous.future
+            logging.info("Queued operation %s superseded by a newer one", key)
+        else:
+            future = loop.create_future()
+
+        for superseded_key in supersedes:
+            superseded = self.pending.pop(superseded_key, None)
+            if superseded is not None:
+                superseded.superseded = True
+                superseded.future.set_result(None)
+                logging.info("Queued operation %s dropped by %s", superseded_key, key)
+
+        op = Operation(lane, key, priority, next(self.seq), func, args, batch, idempotency, future)
+        self.pending[key] = op
+
+        if lane not in self.lanes:
+            self.lanes[lane] = deque([op])
+            loop.create_task(self.run_lane(lane))
+        else:
+            self.lanes[lane].append(op)
+
+        return future
+
+    def head(self, lane):
+        queue = self.lanes[lane]
+        while queue and queue[0].superseded:
+            queue.popleft()
+        return queue[0] if queue else None
+
+    def take(self, lane):
+        # Next operation of the lane, plus the ones right behind it that can
+        # go in the same batch request
+        op = self.head(lane)
+        if op is None:
+            return []
+
+        queue = self.lanes[lane]
+        ops = [queue.popleft()]
+        while op.batch is not None and self.head(lane) is not None and queue[0].batch is op.batch:
+            ops.append(queue.popleft())
+
+        for taken in ops:
+            self.pending.pop(taken.key, None)
+        return ops
+
+    async def execute(self, ops):
+        # Returns the operations to try again later, and how much later
+        for op in ops:
+            self.running[op.key] = op
+        # Sent along as the Idempotency-Key header, one per item of a batch
+        token = backend.idempotency_keys.set(tuple(op.idempotency for op in ops))
+        # The lane's task was started by whichever object first used it
+        logged = logs.about(*ops[0].key[:2])
+        try:
+            if len(ops) > 1:
+                result = await call(ops[0].batch, [op.args[0] for op in ops])
+            else:
+                result = await call(ops[0].func, *ops[0].args)
+        except backend.BackendUnavailable as e:
+            deferred = []
+            for op in ops:
+                if op.future.done():
+                    continue
+                if op.deferrals < DEFER_LIMIT:
+                    op.deferrals += 1
+                    deferred.append(op)
+                else:
+                    op.future.set_exception(e)
+            if deferred:
+                logging.info("%s, putting back %d operation(s) of %s", e, len(deferred), ops[0].lane)
+                return deferred, e.retry_after + backend.backoff(max(op.deferrals for op in deferred))
+        except Exception as e:
+            for op in ops:
+                if not op.future.done():
+                    op.future.set_exception(e)
+        else:
+            for op in ops:
+                if op.idempotency is not None and succeeded(result):
+                    self.remember(op, result)
+                if not op.future.done():
+                    op.future.set_result(result)
+        finally:
+            logs.unbind(logged)
+            backend.idempotency_keys.reset(token)
+            for op in ops:
+                if self.running.get(op.key) is op:
+                    del self.running[op.key]
+        return [], 0
+
+    def defer(self, ops):
+        # Make deferred operations pending again, so repeats join them and
+        # newer ones replace them, and return those still to run
+        kept = []
+        for op in ops:
+            newer = self.pending.get(op.key)
+            if newer is not None:
+                newer.future.add_done_callback(functools.partial(chain, op.future))
+                op.superseded = True
+            else:
+                self.pending[op.key] = op
+                kept.append(op)
+        return kept
+
+    async def run_lane(self, lane):
+        try:
+            while self.head(lane) is not None:
+                await self.limiter.acquire(self.head(lane).priority)
+                deferred = []
+                try:
+                    # Taken after the wait, more urgent work may have arrived meanwhile
+                    ops = self.take(lane)
+                    if ops:
+                        deferred, delay = await self.execute(ops)
+                finally:
+                    self.limiter.release()
+
+                if deferred:
+                    # The lane waits, keeping its order, while the others go on
+                    kept = self.defer(deferred)
+                    await asyncio.sleep(delay)
+                    self.lanes[lane].extendleft(reversed(kept))
+        finally:
+            del self.lanes[lane]
+
+
+async def call(func, *args):
+    # Provider methods are async; plain functions run on a thread
+    if asyncio.iscoroutinefunction(func):
+        return await func(*args)
+    return await asyncio.to_thread(func, *args)
+
+def chain(target, source):
+    # Settle target the way source was settled
+    if target.done():
+        return
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+def succeeded(result):
+    return all(getattr(response, "ok", True) for response in registry.responses(result))
+
+
+_queue = None
+
+
+def get_queue():
+    global _queue
+
+    if _queue is None:
+        _queue = WorkQueue(config.BACKEND_CONCURRENCY)
+    return _queue
+
+def submit(lane, key, priority, func, *args, batch=None, supersedes=(), idempotency=None):
+    return get_queue().submit(
+        lane, key, priority, func, *args, batch=batch, supersedes=supersedes, idempotency=idempotency
+    )
@@ -0,0 +1,123 @@
+import asyncio
+import datetime
+import logging
+import os
+import time
+
+import kubernetes
+
+import kubeclient
+import logs
+import model
+from providers import registry
+
+# Seconds between two status patches of the same object
+FLUSH_INTERVAL = float(os.environ.get("STATUS_FLUSH_INTERVAL", "2"))
+# status.progress.clusters.<name>, status.progress.links.<green/rose> and status.progress.apps.<id>
+STATUS_FIELD = "progress"
+
+# (namespace, name) -> {"clusters": {name: entry}, "apps": {id: entry}} not written yet
+_pending = {}
+# (namespace, name, kind, key) -> time.monotonic() the entry went pending, for the durations
+_started = {}
+# (namespace, name, kind, key) -> last state recorded, so repeated reports are not written again
+_states = {}
+
+_api = None
+_flusher = None
+
+
+def get_api():
+    global _api
+
+    if _api is None:
+        _api = kubernetes.client.CustomObjectsApi(kubeclient.get_client())
+    return _api
+
+def response_code(result):
+    responses = registry.responses(result)
+    return getattr(responses[0], "status_code", None) if responses else None
+
+def record(body, kind, key, state, result=None, error=None):
+    # Queue the progress of one cluster, link or app ("pending", "deploying",
+    # "ready", "error", or "deleted" which removes the entry)
+    object_key = model.object_key(body)
+    timing_key = (*object_key, kind, key)
+    now = time.monotonic()
+
+    if _states.get(timing_key) == state and result is None and error is None:
+        return
+    _states[timing_key] = state
+
+    if state == "deleted":
+        entry = None
+        _started.pop(timing_key, None)
+        _states.pop(timing_key, None)
+    else:
+        entry = {"state": state, "since": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")}
+        if state == "pending":
+            _started[timing_key] = now
+        elif timing_key in _started:
+            entry["seconds"] = round(now - _started[timing_key], 1)
+        if state in ("ready", "error"):
+            _started.pop(timing_key, None)
+
+        code = response_code(result)
+        if code is not None:
+            entry["lastResponse"] = code
+        if error is not None:
+            entry["error"] = str(error)
+
+    _pending.setdefault(object_key, {}).setdefault(kind, {})[str(key)] = entry
+    ensure_flusher()
+
+def ensure_flusher():
+    global _flusher
+
+    if _flusher is None or _flusher.done():
+        _flusher = asyncio.get_running_loop().create_task(flush_loop())
+
+async def flush_loop():
+    while _pending:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        await flush()
+
+async def flush():
+    # One JSON merge-patch per object with everything recorded since the last flush
+    pending = dict(_pending)
+    _pending.clear()
+
+    for (namespace, name), progress in pending.items():
+        patch = {"status": {STATUS_FIELD: progress}}
+        # The flusher's task was started by whichever object recorded first
+        logged = logs.about(namespace, name)
+        try:
+            await asyncio.to_thread(
+                get_api().patch_namespaced_custom_object,
+                "charity-project.eu", "v1", namespace, "lowlevelorchestrations", name, patch
+            )
+        except kubernetes.client.ApiException as e:
+            if e.status == 404:
+                continue
+            logging.warning("Could not write the status of %s/%s: %s", namespace, name, e.reason)
+            requeue((namespace, name), progress)
+        except Exception as e:
+            logging.warning("Could not write the status of %s/%s: %s", namespace, name, e)
+            requeue((namespace, name), progress)
+        finally:
+            logs.unbind(logged)
+
+def requeue(object_key, progress):
+    # Put back what could not be written, unless newer progress was recorded meanwhile
+    pending = _pending.setdefault(object_key, {})
+    for kind, entries in progress.items():
+        for key, entry in entries.items():
+            pending.setdefault(kind, {}).setdefault(key, entry)
+    ensure_flusher()
+
+def forget(body):
+    object_key = model.object_key(body)
+    _pending.pop(object_key, None)
+    for states in (_started, _states):
+        for key in [key for key in states if key[:2] == object_key]:
+            del states[key]
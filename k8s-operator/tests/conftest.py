@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The operator's modules import each other by name, as kopf runs them
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "kopf-operator"))
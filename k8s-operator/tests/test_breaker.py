@@ -0,0 +1,63 @@
+import pytest
+
+from providers.backend.breaker import BackendUnavailable, CircuitBreaker
+
+
+def expire(breaker):
+    # As if the reset period had passed since the circuit opened
+    breaker.opened_at -= breaker.reset
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("apps", failures=3, reset=60)
+    for _ in range(2):
+        breaker.allow()
+        breaker.record(False)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.allow()
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(BackendUnavailable) as raised:
+        breaker.allow()
+    assert raised.value.operation == "apps"
+    assert 0 < raised.value.retry_after <= 60
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker("apps", failures=2, reset=60)
+    breaker.record(False)
+    breaker.record(True)
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+def test_lets_one_probe_through_once_reset():
+    breaker = CircuitBreaker("apps", failures=1, reset=60)
+    breaker.record(False)
+    expire(breaker)
+
+    breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(BackendUnavailable):
+        breaker.allow()
+
+def test_probe_success_closes():
+    breaker = CircuitBreaker("apps", failures=1, reset=60)
+    breaker.record(False)
+    expire(breaker)
+    breaker.allow()
+
+    breaker.record(True)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.allow()
+    breaker.allow()
+
+def test_probe_failure_opens_again():
+    breaker = CircuitBreaker("apps", failures=3, reset=60)
+    for _ in range(3):
+        breaker.record(False)
+    expire(breaker)
+    breaker.allow()
+
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(BackendUnavailable):
+        breaker.allow()
@@ -0,0 +1,103 @@
+import asyncio
+import json
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import callbacks
+import readiness
+
+BODY = {"metadata": {"namespace": "orchestration", "name": "llo"}}
+
+
+@pytest.fixture(autouse=True)
+def listening(monkeypatch):
+    monkeypatch.setattr(callbacks, "CALLBACK_SECRET", "secret")
+    monkeypatch.setattr(callbacks, "_runner", object())
+    yield
+    callbacks.forget(BODY)
+    readiness.forget(BODY)
+
+def post(items, signature=None, payload=None):
+    # POSTs to the callback endpoint, signed unless a signature is given;
+    # returns the status and the JSON answer
+    payload = payload if payload is not None else json.dumps(items).encode()
+    headers = {callbacks.SIGNATURE_HEADER: signature if signature is not None else callbacks.signature(payload)}
+
+    async def send():
+        app = web.Application()
+        app.router.add_post("/callbacks", callbacks.handle)
+        async with TestClient(TestServer(app)) as client:
+            response = await client.post("/callbacks", data=payload, headers=headers)
+            return response.status, await response.json()
+
+    return asyncio.run(send())
+
+def test_signature():
+    assert callbacks.signed(b"{}", callbacks.signature(b"{}"))
+    assert not callbacks.signed(b"{}", callbacks.signature(b"[]"))
+    assert not callbacks.signed(b"{}", "")
+    assert not callbacks.signed(b"{}", "sha256=é")
+
+def test_unsigned_callbacks_are_refused():
+    assert post({"idempotencyKey": "k", "status": "succeeded"}, signature="sha256=00")[0] == 401
+    assert post({"idempotencyKey": "k", "status": "succeeded"}, signature="sha256=é")[0] == 401
+
+def test_malformed_callbacks_are_refused():
+    assert post(None, payload=b"not json")[0] == 400
+    assert post({"status": "succeeded"})[0] == 400
+
+def test_callbacks_are_matched_by_idempotency_key():
+    callbacks.expect(BODY, "apps", "1", "k1")
+    callbacks.expect(BODY, "apps", "2", "k2")
+
+    status, answer = post([
+        {"idempotencyKey": "k1", "status": "succeeded"},
+        {"idempotencyKey": "k2", "status": "done"},
+        {"idempotencyKey": "other", "status": "succeeded"},
+    ])
+
+    assert status == 202
+    assert answer == {"accepted": 1, "unknown": 2}
+
+def test_waiter_wakes_on_success_and_failure():
+    async def main():
+        callbacks.expect(BODY, "apps", "1", "k1")
+        callbacks.expect(BODY, "links", ("green", "rose"), "k2")
+        app = asyncio.ensure_future(callbacks.completion(BODY, "apps", "1"))
+        link = asyncio.ensure_future(callbacks.completion(BODY, "links", ("green", "rose")))
+        await asyncio.sleep(0)
+
+        callbacks.complete("k1", callbacks.SUCCEEDED)
+        callbacks.complete("k2", callbacks.FAILED, "no route")
+        assert await app is True
+        with pytest.raises(callbacks.OperationFailed, match="no route"):
+            await link
+
+    asyncio.run(main())
+
+def test_callback_before_the_wait_is_kept():
+    async def main():
+        callbacks.expect(BODY, "apps", "1", "k1")
+        callbacks.complete("k1", callbacks.SUCCEEDED)
+        return await callbacks.completion(BODY, "apps", "1")
+
+    assert asyncio.run(main()) is True
+
+def test_newer_operation_replaces_the_expected_one():
+    callbacks.expect(BODY, "apps", "1", "old")
+    callbacks.expect(BODY, "apps", "1", "new")
+
+    assert not callbacks.complete("old", callbacks.SUCCEEDED)
+    assert callbacks.complete("new", callbacks.SUCCEEDED)
+
+def test_cluster_callback_sets_its_readiness():
+    async def main():
+        callbacks.expect(BODY, "clusters", "green", "k1")
+        waiter = asyncio.ensure_future(readiness.wait_cluster(BODY, "green"))
+        await asyncio.sleep(0)
+        callbacks.complete("k1", callbacks.SUCCEEDED)
+        return await waiter
+
+    assert asyncio.run(main()) == "ready"
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+from types import SimpleNamespace
+
+import pytest
+from prometheus_client import REGISTRY
+
+import debounce
+import metrics
+
+BODY = {"metadata": {"namespace": "orchestration", "name": "llo"}}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(debounce, "time", SimpleNamespace(monotonic=lambda: now.value))
+    monkeypatch.setattr(debounce, "DEBOUNCE_WINDOW", 3.0)
+    yield now
+    debounce.forget(BODY)
+
+def test_first_change_after_quiet_is_handled_at_once(clock):
+    assert debounce.remaining(BODY, "v1") == 0
+    debounce.handled(BODY)
+
+    clock.value += 3
+    assert debounce.remaining(BODY, "v2") == 0
+
+def test_burst_waits_until_the_spec_settles(clock):
+    debounce.handled(BODY)
+
+    clock.value += 1
+    assert debounce.remaining(BODY, "v2") == 3
+    clock.value += 2
+    assert debounce.remaining(BODY, "v2") == 1
+    # Another change starts the window again
+    assert debounce.remaining(BODY, "v3") == 3
+    clock.value += 3
+    assert debounce.remaining(BODY, "v3") == 0
+
+def test_discard_keeps_the_window(clock):
+    debounce.handled(BODY)
+    clock.value += 1
+    assert debounce.remaining(BODY, "v2") == 3
+
+    # Back to the spec last handled, then changed again within the window
+    debounce.discard(BODY)
+    clock.value += 1
+    assert debounce.remaining(BODY, "v3") == 3
+
+def test_waiting_is_retried_after_the_wait():
+    waiting = debounce.Waiting("llo", 2.5)
+
+    assert waiting.delay == 2.5
+    assert str(waiting).startswith(debounce.Waiting.PREFIX)
+
+def record(message, level=logging.ERROR):
+    return logging.LogRecord("kopf.objects", level, __file__, 0, message, None, None)
+
+@pytest.fixture
+def kopf_level():
+    logger = logging.getLogger("kopf.objects")
+    level = logger.level
+    yield logger.setLevel
+    logger.setLevel(level)
+
+def test_kopf_error_for_a_wait_is_debug(kopf_level):
+    kopf_level(logging.INFO)
+    quiet = debounce.Quiet()
+    waiting = record(f"Handler 'llorchestration_update' failed temporarily: {debounce.Waiting('llo', 3)}")
+
+    assert not quiet.filter(waiting)
+    assert waiting.levelno == logging.DEBUG and waiting.levelname == "DEBUG"
+
+    kopf_level(logging.DEBUG)
+    assert quiet.filter(record(f"Handler 'llorchestration_update' failed temporarily: {debounce.Waiting('llo', 3)}"))
+
+def test_other_errors_are_left_alone():
+    failed = record("Handler 'llorchestration_update' failed temporarily: orch-backend answered 503")
+
+    assert debounce.Quiet().filter(failed)
+    assert failed.levelno == logging.ERROR
+
+def test_waits_are_not_timed():
+    def count():
+        return REGISTRY.get_sample_value("handler_duration_seconds_count", {"handler": "debounce-test"}) or 0
+
+    @metrics.timed("debounce-test", untimed=debounce.Waiting)
+    async def handler(wait):
+        if wait:
+            raise debounce.Waiting("llo", 1)
+
+    with pytest.raises(debounce.Waiting):
+        asyncio.run(handler(True))
+    assert count() == 0
+
+    asyncio.run(handler(False))
+    assert count() == 1
@@ -0,0 +1,57 @@
+import diffing
+import model
+
+
+def cluster(name, **fields):
+    return {"name": name, "kubernetes-type": "kubeadm", "worker-machine-count": 1, **fields}
+
+def app(id_, cluster_name, image="docker.io/kong/httpbin", **fields):
+    return {"id": id_, "name": f"app-{id_}", "cluster": cluster_name,
+            "components": [{"name": "web", "image": image}], **fields}
+
+def spec(clusters=(), apps=(), links=()):
+    return model.parse({"spec": {"clusters": list(clusters), "apps": list(apps), "links": list(links)}})
+
+def test_create_update_delete():
+    old = spec(apps=[app("1", "green"), app("2", "green"), app("3", "green")])
+    new = spec(apps=[app("1", "green"), app("2", "green", image="docker.io/kong/httpbin:latest"), app("4", "rose")])
+
+    diff = diffing.diff_spec(old, new, "apps")
+
+    assert [entry.id for entry in diff.create] == ["4"]
+    assert [(before.id, after.id) for before, after in diff.update] == [("2", "2")]
+    assert diff.update[0][0].raw["components"][0]["image"] == "docker.io/kong/httpbin"
+    assert [entry.id for entry in diff.delete] == ["3"]
+
+def test_unchanged_spec_has_no_diff():
+    old = spec(clusters=[cluster("green")], apps=[app("1", "green")])
+    new = spec(clusters=[cluster("green")], apps=[app("1", "green")])
+
+    assert diffing.diff_spec(old, new, "clusters") == diffing.Diff([], [], [])
+    assert diffing.diff_spec(old, new, "apps") == diffing.Diff([], [], [])
+
+def test_status_is_ignored():
+    old = spec(clusters=[cluster("green", status="deploying")])
+    new = spec(clusters=[cluster("green", status="ready")])
+
+    assert diffing.diff_spec(old, new, "clusters") == diffing.Diff([], [], [])
+    assert len(diffing.diff_spec(old, new, "clusters", ignored=frozenset()).update) == 1
+
+def test_changed_field_is_an_update():
+    old = spec(clusters=[cluster("green")])
+    new = spec(clusters=[cluster("green", **{"worker-machine-count": 3})])
+
+    diff = diffing.diff_spec(old, new, "clusters")
+
+    assert diff.create == [] and diff.delete == []
+    assert [after.worker_machine_count for _, after in diff.update] == [3]
+
+def test_links_match_by_pair():
+    old = spec(links=[["green", "rose"], ["green", "blue"]])
+    new = spec(links=[["green", "rose"], ["rose", "green"]])
+
+    diff = diffing.diff_spec(old, new, "links")
+
+    assert [entry.label for entry in diff.create] == ["rose/green"]
+    assert diff.update == []
+    assert [entry.label for entry in diff.delete] == ["green/blue"]
@@ -0,0 +1,72 @@
+import pytest
+
+import drift
+
+BODY = {
+    "metadata": {"namespace": "orchestration", "name": "llo"},
+    "spec": {
+        "clusters": [
+            {"name": "green", "worker-machine-count": 2},
+            {"name": "rose", "worker-machine-count": 1},
+            {"name": "ext", "provider": "external", "worker-machine-count": 3},
+            {"name": "broken", "worker-machine-count": 1, "status": "error"},
+        ],
+        "links": [["green", "rose"], ["green", "broken"]],
+        "apps": [{"id": "1", "cluster": "llo-green"}, {"id": "2", "cluster": "broken"}],
+    },
+    "status": {"progress": {"links": {"green/rose": {"state": "ready"}}}},
+}
+
+
+def observed(**clusters):
+    return {
+        "clusters": {name: {"clusterName": name, "controlPlaneCount": None, "workerMachineCount": count}
+                     for name, count in clusters.items()},
+        "apps": {},
+    }
+
+@pytest.fixture(autouse=True)
+def desired():
+    drift.remember(BODY)
+    yield
+    drift.forget(BODY)
+
+def names(entries):
+    return sorted(getattr(entry, "name", None) or getattr(entry, "label", None) or entry.id for entry in entries)
+
+def test_in_sync_is_not_drifted():
+    create, update, relink, install = drift.drifted(BODY, observed(green=2, rose=1, ext=3, broken=1))
+
+    assert (create, update, relink) == ([], [], [])
+    assert names(install) == ["1"]
+
+def test_missing_cluster_is_recreated_and_relinked():
+    create, update, relink, _ = drift.drifted(BODY, observed(rose=1, ext=3, broken=1))
+
+    assert names(create) == ["green"]
+    assert update == []
+    assert names(relink) == ["green/rose"]
+
+def test_rescales_changed_counts():
+    _, update, _, _ = drift.drifted(BODY, observed(green=1, rose=1, ext=3, broken=1))
+
+    assert names(update) == ["green"]
+
+def test_leaves_external_clusters_alone():
+    _, update, _, _ = drift.drifted(BODY, observed(green=2, rose=1, ext=1, broken=1))
+
+    assert update == []
+
+def test_skips_clusters_in_error():
+    create, _, relink, install = drift.drifted(BODY, observed(green=2, rose=1, ext=3))
+
+    assert create == []
+    assert "green/broken" not in names(relink)
+    assert "2" not in names(install)
+
+def test_recently_issued_is_not_drifted():
+    drift.mark_issued(BODY, "clusters", ["green"])
+
+    create, _, _, _ = drift.drifted(BODY, observed(rose=1, ext=3, broken=1))
+
+    assert create == []
@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+
+import fingerprints
+import model
+
+
+def body(clusters=(), apps=(), links=(), stored=None, version=None):
+    metadata = {"namespace": "orchestration", "name": "llo"}
+    if version is not None:
+        metadata["resourceVersion"] = version
+    status = {fingerprints.STATUS_FIELD: stored} if stored is not None else {}
+    return {"metadata": metadata, "status": status,
+            "spec": {"clusters": list(clusters), "apps": list(apps), "links": list(links)}}
+
+def of(body):
+    return fingerprints.spec_fingerprints(model.parse(body))
+
+def stored(body):
+    patch = SimpleNamespace(status={})
+    fingerprints.store(patch, body, of(body))
+    return patch.status[fingerprints.STATUS_FIELD]
+
+def test_fingerprint_ignores_key_order_and_ignored_fields():
+    assert fingerprints.fingerprint({"a": 1, "b": 2}) == fingerprints.fingerprint({"b": 2, "a": 1})
+    assert fingerprints.fingerprint({"a": 1, "status": "ready"}, {"status"}) == fingerprints.fingerprint({"a": 1})
+    assert fingerprints.fingerprint({"a": 1}) != fingerprints.fingerprint({"a": 2})
+
+def test_status_writes_are_unchanged():
+    handled = body(clusters=[{"name": "green", "status": "deploying"}], apps=[{"id": "1", "cluster": "green"}])
+    written = body(clusters=[{"name": "green", "status": "ready"}], apps=[{"id": "1", "cluster": "green", "status": "running"}],
+                   stored=stored(handled))
+
+    assert fingerprints.unchanged(written, of(written))
+
+def test_spec_changes_are_not_unchanged():
+    handled = body(clusters=[{"name": "green", "worker-machine-count": 1}], links=[["green", "rose"]])
+    scaled = body(clusters=[{"name": "green", "worker-machine-count": 2}], links=[["green", "rose"]],
+                  stored=stored(handled))
+    relinked = body(clusters=[{"name": "green", "worker-machine-count": 1}], links=[["green", "blue"]],
+                    stored=stored(handled))
+
+    assert not fingerprints.unchanged(scaled, of(scaled))
+    assert not fingerprints.unchanged(relinked, of(relinked))
+
+def test_links_in_any_order():
+    assert of(body(links=[["a", "b"], ["c", "d"]]))["links"] == of(body(links=[["c", "d"], ["a", "b"]]))["links"]
+
+def test_store_nulls_out_removed_entries():
+    handled = body(apps=[{"id": "1", "cluster": "green"}, {"id": "2", "cluster": "green"}])
+    removed = body(apps=[{"id": "1", "cluster": "green"}], stored=stored(handled))
+
+    value = stored(removed)
+
+    assert value["apps"]["2"] is None
+    assert value["apps"]["1"] == of(handled)["apps"]["1"]
+
+def test_unchanged_entries_keep_their_fingerprint():
+    first = model.parse(body(apps=[{"id": "1", "cluster": "green", "status": "deploying"}], version="1"))
+    app = first.apps["1"]
+    assert app.fingerprint
+
+    second = model.parse(body(apps=[{"id": "1", "cluster": "green", "status": "running"}], version="2"))
+    try:
+        assert second.apps["1"]._fingerprint == app.fingerprint
+    finally:
+        model.forget(body())
@@ -0,0 +1,82 @@
+import pytest
+
+from providers.backend.limiter import AdaptiveLimit
+
+
+def settled(limit):
+    # As if the decrease interval had passed
+    limit.decreased_at -= limit.interval
+
+def test_usual_answers_raise_the_limit_up_to_maximum():
+    limit = AdaptiveLimit(maximum=4)
+    limit.limit = 2.0
+
+    assert limit.record("apps", 0.5, True) == 2.5
+    assert limit.record("apps", 0.6, True) == pytest.approx(2.9)
+    for _ in range(20):
+        limit.record("apps", 0.5, True)
+    assert limit.limit == 4
+
+def test_errors_halve_the_limit():
+    limit = AdaptiveLimit(maximum=8)
+
+    assert limit.record("apps", 0.5, False) == 4
+    settled(limit)
+    assert limit.record("apps", 0.5, False) == 2
+
+def test_answers_slower_than_usual_halve_the_limit():
+    limit = AdaptiveLimit(maximum=8, tolerance=2.0)
+    limit.record("apps", 0.5, True)
+
+    assert limit.record("apps", 1.5, True) == 4
+
+def test_each_endpoint_has_its_own_usual_latency():
+    limit = AdaptiveLimit(maximum=8, tolerance=2.0)
+    limit.record("apps", 0.2, True)
+
+    # Deploys always take long, which is no sign of trouble
+    for _ in range(10):
+        limit.record("deploycluster", 20.0, True)
+    assert limit.limit == 8
+
+    assert limit.record("apps", 20.0, True) == 4
+
+def test_lasting_change_becomes_the_baseline():
+    limit = AdaptiveLimit(maximum=8, tolerance=2.0, smoothing=0.5)
+    limit.record("apps", 1.0, True)
+
+    for _ in range(10):
+        limit.record("apps", 3.0, True)
+        settled(limit)
+    shrunk = limit.limit
+    limit.record("apps", 3.0, True)
+    assert limit.limit > shrunk
+
+def test_quick_answers_are_never_slow():
+    limit = AdaptiveLimit(maximum=8, floor=0.1)
+    limit.record("apps", 0.001, True)
+
+    assert limit.record("apps", 0.05, True) == 8
+
+def test_a_burst_of_failures_decreases_once():
+    limit = AdaptiveLimit(maximum=8)
+
+    for _ in range(5):
+        limit.record("apps", 0.5, False)
+    assert limit.limit == 4
+
+def test_never_below_minimum():
+    limit = AdaptiveLimit(maximum=8, minimum=3)
+
+    for _ in range(5):
+        limit.record("apps", 0.5, False)
+        settled(limit)
+    assert limit.limit == 3
+
+def test_bounds_the_requests_in_flight():
+    limit = AdaptiveLimit(maximum=2)
+    limit.limit = 1.5
+
+    with limit:
+        assert limit.in_flight == 1
+    assert limit.in_flight == 0
@@ -0,0 +1,25 @@
+import model
+import operations
+
+BODY = {
+    "metadata": {"namespace": "orchestration", "name": "llo"},
+    "spec": {"clusters": [{"name": "green"}, {"name": "rose"}]},
+}
+
+
+def app(cluster):
+    return model.App({"id": "1", "cluster": cluster})
+
+def test_cluster_name_with_or_without_prefix():
+    names = {"green", "rose"}
+
+    assert model.cluster_name(BODY, "green", names) == "green"
+    assert model.cluster_name(BODY, "llo-green", names) == "green"
+    assert model.cluster_name(BODY, "llo-blue", names) is None
+    assert model.cluster_name(BODY, None, names) is None
+
+def test_apps_queue_on_their_cluster_lane():
+    assert operations.app_lane(BODY, app("green")) == "green"
+    assert operations.app_lane(BODY, app("llo-rose")) == "rose"
+    # A cluster outside the spec keeps the name the app gives it
+    assert operations.app_lane(BODY, app("llo-external")) == "llo-external"
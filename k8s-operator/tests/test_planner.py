@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+
+import model
+import operations
+import planner
+import readiness
+import writeback
+
+BODY = {"metadata": {"namespace": "orchestration", "name": "llo"}}
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.ok = status_code < 400
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    # Records the operations sent and the progress written; clusters answer
+    # with the code in codes and are ready as soon as they are waited for
+    sent = []
+    progress = []
+    codes = {}
+
+    def operation(action, key):
+        def submit(body, entry):
+            sent.append((action, getattr(entry, key)))
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(Response(codes.get(getattr(entry, key), 200)))
+            return future
+        return submit
+
+    async def wait_cluster(body, name, query=None):
+        sent.append(("ready", name))
+        return "ready"
+
+    monkeypatch.setattr(operations, "create_cluster", operation("deploy", "name"))
+    monkeypatch.setattr(operations, "link_clusters", operation("link", "label"))
+    monkeypatch.setattr(operations, "install_app", operation("install", "id"))
+    monkeypatch.setattr(readiness, "wait_cluster", wait_cluster)
+    monkeypatch.setattr(writeback, "record", lambda body, kind, key, state, result=None, error=None:
+                        progress.append((kind, key, state, getattr(result, "status_code", None))))
+    return sent, progress, codes
+
+
+def spec():
+    return model.parse({"spec": {
+        "clusters": [{"name": "green"}, {"name": "rose"}, {"name": "blue"}],
+        "links": [["green", "rose"]],
+        "apps": [
+            {"id": "1", "cluster": "llo-green", "components": [{"name": "web", "cluster-selector": "rose"}]},
+            {"id": "2", "cluster": "blue"},
+        ],
+    }})
+
+def rollout(spec):
+    plan = planner.rollout_plan(BODY, spec.clusters.values(), spec.links.values(), spec.apps.values())
+    return plan.execute()
+
+def test_nodes_wait_for_their_dependencies():
+    async def main():
+        order = []
+        plan = planner.Plan()
+
+        def step(name, delay):
+            async def run():
+                await asyncio.sleep(delay)
+                order.append(name)
+            return run
+
+        plan.add("app", step("app", 0), deps=["link"])
+        plan.add("link", step("link", 0), deps=["green", "rose"])
+        plan.add("green", step("green", 0.02))
+        plan.add("rose", step("rose", 0.01))
+        await plan.execute()
+        return order
+
+    assert asyncio.run(main()) == ["rose", "green", "link", "app"]
+
+def test_failed_dependency_blocks_and_does_not_run():
+    async def main():
+        ran, blocked = [], []
+        plan = planner.Plan()
+
+        async def fail():
+            raise RuntimeError("boom")
+
+        async def run():
+            ran.append("app")
+
+        plan.add("cluster", fail)
+        plan.add("app", run, deps=["cluster"], blocked=blocked.append)
+        with pytest.raises(RuntimeError):
+            await plan.execute()
+        return ran, blocked
+
+    ran, blocked = asyncio.run(main())
+    assert ran == []
+    assert [str(error) for error in blocked] == ["boom"]
+
+def test_rollout_follows_clusters_links_apps(backend):
+    sent, progress, _ = backend
+    asyncio.run(rollout(spec()))
+
+    assert sent.index(("link", "green/rose")) > max(sent.index(("ready", "green")), sent.index(("ready", "rose")))
+    assert sent.index(("install", "1")) > sent.index(("link", "green/rose"))
+    assert sent.index(("install", "2")) > sent.index(("ready", "blue"))
+    assert ("clusters", "green", "ready", None) in progress
+    assert ("apps", "1", "deploying", 200) in progress
+
+def test_rejected_deploy_blocks_at_once(backend):
+    sent, progress, codes = backend
+    codes["green"] = 400
+
+    with pytest.raises(planner.Rejected):
+        asyncio.run(rollout(spec()))
+
+    # Not waited for, and what depends on it is never sent
+    assert ("ready", "green") not in sent
+    assert ("link", "green/rose") not in sent and ("install", "1") not in sent
+    assert ("install", "2") in sent
+    assert ("clusters", "green", "error", 400) in progress
+    assert [state for kind, key, state, _ in progress if key == "green/rose"] == ["pending", "error"]
+    assert [state for kind, key, state, _ in progress if key == "1"] == ["pending", "error"]
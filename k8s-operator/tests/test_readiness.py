@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+import model
+import readiness
+
+
+def body(status, version):
+    return {
+        "metadata": {"namespace": "orchestration", "name": "llo", "resourceVersion": version},
+        "spec": {"clusters": [{"name": "green", "status": status}]},
+    }
+
+
+@pytest.fixture(autouse=True)
+def clean():
+    yield
+    readiness.forget(body(None, "0"))
+    model.forget(body(None, "0"))
+
+def wait(timeout=0.05):
+    return asyncio.wait_for(readiness.wait_cluster(body(None, "0"), "green"), timeout)
+
+def test_ready_status_wakes_the_waiter():
+    async def main():
+        readiness.observe(body("deploying", "1"))
+        waiter = asyncio.ensure_future(wait(1))
+        await asyncio.sleep(0)
+        readiness.observe(body("ready", "2"))
+        return await waiter
+
+    assert asyncio.run(main()) == "ready"
+
+def test_error_status_fails_the_waiter():
+    async def main():
+        readiness.observe(body("error", "1"))
+        await wait()
+
+    with pytest.raises(readiness.ClusterFailed):
+        asyncio.run(main())
+
+def test_redeployed_cluster_ignores_its_old_status():
+    async def main():
+        readiness.observe(body("ready", "1"))
+        readiness.reset(body("ready", "1"), "green")
+        waiter = asyncio.ensure_future(wait(1))
+        await asyncio.sleep(0)
+
+        # The operator's own status write, the spec still says ready
+        readiness.observe(body("ready", "2"))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+
+        readiness.observe(body("deploying", "3"))
+        readiness.observe(body("ready", "4"))
+        return await waiter
+
+    assert asyncio.run(main()) == "ready"
+
+def test_redeployed_cluster_trusts_a_fresh_report():
+    async def main():
+        readiness.observe(body("ready", "1"))
+        readiness.reset(body("ready", "1"), "green")
+        readiness.reset(body("ready", "1"), "green")
+        waiter = asyncio.ensure_future(wait(1))
+        await asyncio.sleep(0)
+
+        # A callback or a readiness query
+        readiness.set_status(readiness.cluster_key(body(None, "0"), "green"), "ready")
+        return await waiter
+
+    assert asyncio.run(main()) == "ready"
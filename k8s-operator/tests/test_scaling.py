@@ -0,0 +1,61 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+import model
+import operations
+import scaling
+
+BODY = {"metadata": {"namespace": "orchestration", "name": "llo"}}
+
+
+def clusters(**counts):
+    return model.parse({"spec": {"clusters": [
+        {"name": name, "worker-machine-count": count, **({"provider": "external"} if name == "ext" else {})}
+        for name, count in counts.items()
+    ]}}).clusters
+
+def changes(old, new):
+    old, new = clusters(**old), clusters(**new)
+    return scaling.scale_changes((old[name], new[name]) for name in new)
+
+@pytest.fixture
+def answers(monkeypatch):
+    # Status code the backend answers each cluster's patch with
+    codes = {}
+
+    async def scale_cluster(body, cluster):
+        response = requests.Response()
+        response.status_code = codes[cluster.name]
+        return response
+
+    monkeypatch.setattr(operations, "scale_cluster", scale_cluster)
+    return codes
+
+def test_scale_changes_are_deltas():
+    found = changes({"green": 1, "rose": 2, "ext": 1}, {"green": 3, "rose": 2, "ext": 4})
+
+    assert [(change.name, change.worker_delta) for change in found] == [("green", 2)]
+
+def test_accepted_patches_are_requested(answers):
+    answers.update(green=200, rose=202)
+    patch = SimpleNamespace(status={})
+
+    asyncio.run(scaling.apply(BODY, changes({"green": 1, "rose": 1}, {"green": 2, "rose": 3}), patch))
+
+    progress = patch.status[scaling.STATUS_FIELD]
+    assert {name: entry["state"] for name, entry in progress.items()} == {"green": "requested", "rose": "requested"}
+
+def test_error_answer_is_an_error(answers):
+    answers.update(green=200, rose=400)
+    patch = SimpleNamespace(status={})
+
+    with pytest.raises(requests.HTTPError):
+        asyncio.run(scaling.apply(BODY, changes({"green": 1, "rose": 1}, {"green": 2, "rose": 3}), patch))
+
+    progress = patch.status[scaling.STATUS_FIELD]
+    assert progress["green"]["state"] == "requested"
+    assert progress["rose"]["state"] == "error"
+    assert progress["rose"]["error"].startswith("400")
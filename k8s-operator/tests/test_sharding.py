@@ -0,0 +1,68 @@
+import asyncio
+
+import sharding
+
+KEYS = [sharding.ring_key("orchestration", f"llo-{i}") for i in range(2000)]
+
+
+def owners(ring):
+    return {key: ring.owner(key) for key in KEYS}
+
+def test_same_members_same_owners():
+    assert owners(sharding.Ring(["a", "b", "c"])) == owners(sharding.Ring(["c", "a", "b"]))
+
+def test_every_member_owns_a_share():
+    counts = {}
+    for owner in owners(sharding.Ring(["a", "b", "c"])).values():
+        counts[owner] = counts.get(owner, 0) + 1
+
+    assert set(counts) == {"a", "b", "c"}
+    assert min(counts.values()) > len(KEYS) / 3 / 2
+
+def test_joining_member_only_takes_objects():
+    before = owners(sharding.Ring(["a", "b", "c"]))
+    after = owners(sharding.Ring(["a", "b", "c", "d"]))
+
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert moved
+    assert all(after[key] == "d" for key in moved)
+
+def test_leaving_member_only_gives_its_objects():
+    before = owners(sharding.Ring(["a", "b", "c"]))
+    after = owners(sharding.Ring(["a", "b"]))
+
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert moved
+    assert all(before[key] == "c" for key in moved)
+
+def test_empty_ring_has_no_owner():
+    assert sharding.Ring([]).owner(KEYS[0]) is None
+
+def test_startup_does_not_wait_forever(monkeypatch):
+    async def no_lease():
+        await asyncio.sleep(3600)
+
+    monkeypatch.setattr(sharding, "run", no_lease)
+    monkeypatch.setattr(sharding, "STARTUP_TIMEOUT", 0.01)
+    monkeypatch.setattr(sharding, "_task", None)
+    monkeypatch.setattr(sharding, "_late", False)
+
+    async def main():
+        await sharding.start()
+        sharding._task.cancel()
+
+    asyncio.run(main())
+    assert sharding._late
+
+def test_takeover_patch():
+    obj = {"metadata": {"name": "llo", "resourceVersion": "7", "finalizers": [sharding.FINALIZER_PREFIX + "other"]}}
+
+    patch = sharding.takeover_patch(obj)
+    assert patch["metadata"]["finalizers"] == [sharding.FINALIZER]
+    assert patch["metadata"]["annotations"] == {sharding.OWNER_ANNOTATION: sharding.SHARD}
+
+    obj["metadata"].update(finalizers=[sharding.FINALIZER], annotations={sharding.OWNER_ANNOTATION: sharding.SHARD})
+    assert sharding.takeover_patch(obj) is None
+    # Patched all the same after a late ring, so kopf sees the object again
+    stamped = sharding.takeover_patch(obj, "2026-01-01T00:00:00.000000Z")
+    assert stamped["metadata"]["annotations"][sharding.HANDOVER_ANNOTATION] == "2026-01-01T00:00:00.000000Z"
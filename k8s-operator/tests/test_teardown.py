@@ -0,0 +1,106 @@
+import asyncio
+from types import SimpleNamespace
+
+import kopf
+import pytest
+
+import operations
+import teardown
+import writeback
+
+BODY = {
+    "metadata": {"namespace": "orchestration", "name": "llo"},
+    "spec": {
+        "clusters": [{"name": "green"}, {"name": "rose"}, {"name": "broken", "status": "error"}],
+        "links": [["green", "rose"]],
+        "apps": [{"id": "1", "name": "web", "cluster": "green"}, {"id": "2", "name": "db", "cluster": "rose"}],
+    },
+}
+
+
+class Provider:
+    def __init__(self, listed):
+        self.listed = listed
+
+    def method(self, name):
+        return self.list_clusters if name == "list_clusters" else None
+
+    async def list_clusters(self):
+        return [{"clusterName": name} for name in self.listed]
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.ok = status_code < 400
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    # Records when each removal is sent and done; answers with the code in
+    # codes, raises what is in errors, and lists the clusters in listed
+    events = []
+    codes = {}
+    errors = {}
+    listed = set()
+
+    def removal(action, name):
+        def submit(body, entry, *args):
+            key = name(entry)
+            events.append(("sent", action, key))
+
+            async def run():
+                await asyncio.sleep(0.01)
+                events.append(("done", action, key))
+                if key in errors:
+                    raise errors[key]
+                return Response(codes.get(key, 200))
+            return asyncio.ensure_future(run())
+        return submit
+
+    provider = Provider(listed)
+    monkeypatch.setattr(operations, "uninstall_app", removal("uninstall", lambda app: app.id))
+    monkeypatch.setattr(operations, "unlink_clusters", removal("unlink", lambda link: link.label))
+    monkeypatch.setattr(operations, "delete_cluster", removal("delete", lambda cluster: cluster.name))
+    monkeypatch.setattr(operations, "cluster_provider", lambda cluster: provider)
+    monkeypatch.setattr(writeback, "record", lambda *args, **kwargs: None)
+    monkeypatch.setattr(teardown, "TEARDOWN_POLL_INTERVAL", 0.01)
+    return SimpleNamespace(events=events, codes=codes, errors=errors, listed=listed)
+
+
+def test_removes_in_reverse_dependency_order(backend):
+    asyncio.run(teardown.teardown(BODY))
+
+    stages = [action for _, action, _ in backend.events]
+    # Each stage is sent at once, and only once the one before is done
+    assert stages == ["uninstall"] * 4 + ["unlink"] * 2 + ["delete"] * 4
+    assert [key for kind, action, key in backend.events if kind == "sent" and action == "delete"] == ["green", "rose"]
+
+def test_not_found_counts_as_removed(backend):
+    backend.codes["1"] = 404
+
+    asyncio.run(teardown.teardown(BODY))
+
+def test_unconfirmed_removals_are_retried(backend):
+    backend.codes["2"] = 500
+    backend.errors["1"] = ConnectionError("refused")
+
+    with pytest.raises(kopf.TemporaryError, match="Could not remove apps 1, 2 yet"):
+        asyncio.run(teardown.teardown(BODY))
+    # Nothing that depends on them is removed yet
+    assert all(action == "uninstall" for _, action, _ in backend.events)
+
+def test_waits_until_clusters_are_gone(backend, monkeypatch):
+    monkeypatch.setattr(teardown, "TEARDOWN_TIMEOUT", 0.05)
+    backend.listed.add("rose")
+
+    with pytest.raises(kopf.TemporaryError, match="Clusters rose are still being deleted"):
+        asyncio.run(teardown.teardown(BODY))
+
+def test_invalid_spec_is_still_torn_down(backend):
+    body = {**BODY, "spec": {**BODY["spec"], "apps": BODY["spec"]["apps"] + [{"name": "no id"}]}}
+
+    asyncio.run(teardown.teardown(body))
+
+    assert ("sent", "uninstall", "1") in backend.events
+    assert ("sent", "delete", "green") in backend.events
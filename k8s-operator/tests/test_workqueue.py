@@ -0,0 +1,187 @@
+import asyncio
+
+import pytest
+
+import workqueue
+from providers.backend import backend
+
+LANE = ("orchestration", "green")
+
+
+def key(entry, action="deploy"):
+    return ("orchestration", "llo", action, entry)
+
+class Gate:
+    """Operation that records its calls and, once closed, holds them until opened."""
+
+    def __init__(self, result="done"):
+        self.result = result
+        self.calls = []
+        self.event = asyncio.Event()
+        self.event.set()
+
+    def close(self):
+        self.event.clear()
+
+    async def run(self, *args):
+        self.calls.append(args)
+        await self.event.wait()
+        return self.result
+
+
+async def settle():
+    # Lets the lane tasks run until they wait again
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+def test_queued_operation_is_superseded():
+    async def main():
+        queue = workqueue.WorkQueue(limit=1)
+        blocker, op = Gate(), Gate()
+        blocker.close()
+        queue.submit(LANE, key("first"), workqueue.CREATE, blocker.run, "first")
+        await settle()
+
+        older = queue.submit(LANE, key("second"), workqueue.CREATE, op.run, "old")
+        newer = queue.submit(LANE, key("second"), workqueue.CREATE, op.run, "new")
+        assert older is newer
+
+        blocker.event.set()
+        assert await newer == "done"
+        assert op.calls == [("new",)]
+
+    asyncio.run(main())
+
+def test_supersedes_drops_other_keys():
+    async def main():
+        queue = workqueue.WorkQueue(limit=1)
+        blocker, op = Gate(), Gate()
+        blocker.close()
+        queue.submit(LANE, key("first"), workqueue.CREATE, blocker.run, "first")
+        await settle()
+
+        deploy = queue.submit(LANE, key("second"), workqueue.CREATE, op.run, "deploy")
+        delete = queue.submit(LANE, key("second", "delete"), workqueue.DELETE, op.run, "delete",
+                              supersedes=[key("second")])
+        assert await deploy is None
+
+        blocker.event.set()
+        await delete
+        assert op.calls == [("delete",)]
+
+    asyncio.run(main())
+
+def test_urgent_lane_goes_first():
+    async def main():
+        queue = workqueue.WorkQueue(limit=1)
+        order = []
+        blocker = Gate()
+        blocker.close()
+
+        async def record(name):
+            order.append(name)
+
+        queue.submit(("orchestration", "blocker"), key("blocker"), workqueue.CREATE, blocker.run, "blocker")
+        await settle()
+        install = queue.submit(("orchestration", "rose"), key("app"), workqueue.INSTALL, record, "install")
+        delete = queue.submit(("orchestration", "blue"), key("old", "delete"), workqueue.DELETE, record, "delete")
+        await settle()
+
+        blocker.event.set()
+        await asyncio.gather(install, delete)
+        assert order == ["delete", "install"]
+
+    asyncio.run(main())
+
+def test_repeat_joins_queued_running_and_completed():
+    async def main():
+        queue = workqueue.WorkQueue(limit=1)
+        op = Gate()
+        op.close()
+
+        first = queue.submit(LANE, key("app"), workqueue.INSTALL, op.run, "app", idempotency="v1")
+        assert queue.submit(LANE, key("app"), workqueue.INSTALL, op.run, "app", idempotency="v1") is first
+        await settle()
+        assert queue.submit(LANE, key("app"), workqueue.INSTALL, op.run, "app", idempotency="v1") is first
+
+        op.event.set()
+        assert await first == "done"
+        assert await queue.submit(LANE, key("app"), workqueue.INSTALL, op.run, "app", idempotency="v1") == "done"
+        assert len(op.calls) == 1
+
+        # A different version of the entry is sent
+        await queue.submit(LANE, key("app"), workqueue.INSTALL, op.run, "app", idempotency="v2")
+        assert len(op.calls) == 2
+
+    asyncio.run(main())
+
+def test_completed_result_expires():
+    async def main():
+        queue = workqueue.WorkQueue(limit=1, completed_ttl=0)
+        op = Gate()
+
+        await queue.submit(LANE, key("app"), workqueue.INSTALL, op.run, "app", idempotency="v1")
+        await asyncio.sleep(0.01)
+        await queue.submit(LANE, key("app"), workqueue.INSTALL, op.run, "app", idempotency="v1")
+        assert len(op.calls) == 2
+
+    asyncio.run(main())
+
+def test_unavailable_backend_defers(monkeypatch):
+    monkeypatch.setattr(backend, "backoff", lambda attempt: 0)
+
+    async def main():
+        queue = workqueue.WorkQueue(limit=1)
+        calls = []
+
+        async def flaky(name):
+            calls.append(name)
+            if len(calls) < 3:
+                raise backend.BackendUnavailable("clusters", 0)
+            return "done"
+
+        assert await queue.submit(LANE, key("green"), workqueue.CREATE, flaky, "green") == "done"
+        assert calls == ["green"] * 3
+
+    asyncio.run(main())
+
+def test_deferred_operation_is_superseded(monkeypatch):
+    monkeypatch.setattr(backend, "backoff", lambda attempt: 0)
+
+    async def main():
+        queue = workqueue.WorkQueue(limit=1)
+        calls = []
+
+        async def flaky(name):
+            calls.append(name)
+            if name == "old":
+                raise backend.BackendUnavailable("clusters", 0.05)
+            return name
+
+        older = queue.submit(LANE, key("green"), workqueue.CREATE, flaky, "old")
+        await settle()
+        newer = queue.submit(LANE, key("green"), workqueue.CREATE, flaky, "new")
+
+        assert await newer == "new"
+        assert await older == "new"
+        assert calls == ["old", "new"]
+
+    asyncio.run(main())
+
+def test_deferrals_are_bounded(monkeypatch):
+    monkeypatch.setattr(backend, "backoff", lambda attempt: 0)
+    monkeypatch.setattr(workqueue, "DEFER_LIMIT", 2)
+
+    async def main():
+        queue = workqueue.WorkQueue(limit=1)
+        calls = []
+
+        async def down(name):
+            calls.append(name)
+            raise backend.BackendUnavailable("clusters", 0)
+
+        with pytest.raises(backend.BackendUnavailable):
+            await queue.submit(LANE, key("green"), workqueue.CREATE, down, "green")
+        assert len(calls) == 3
+
+    asyncio.run(main())